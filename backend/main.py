@@ -1,7 +1,8 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import os
 import uuid
 import aiofiles
@@ -21,11 +22,15 @@ from schemas import (
 )
 from services.pdf_processor import PDFProcessor
 from services.ai_extractor import AIExtractor
+from services.http_client import close_http_client
 from logger import api_logger, logger
 
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
 
+# VLM部分结果写入数据库的最小间隔（秒）
+VLM_PROGRESS_SAVE_INTERVAL = float(os.getenv("VLM_PROGRESS_SAVE_INTERVAL", "2"))
+
 app = FastAPI(
     title="PDF证据材料信息提取系统",
     description="律师证据材料PDF信息提取和整理系统",
@@ -82,6 +87,12 @@ def get_db():
 pdf_processor = PDFProcessor()
 ai_extractor = AIExtractor()
 
+@app.on_event("shutdown")
+async def shutdown_services():
+    """应用关闭时释放后台资源"""
+    await pdf_processor.shutdown()
+    await close_http_client()
+
 @app.get("/")
 async def root():
     return {"message": "PDF证据材料信息提取系统API"}
@@ -223,20 +234,40 @@ async def process_pdf_background(file_id: str, file_path: str):
         pdf_info = pdf_processor.get_pdf_info(file_path)
         api_logger.info(f"PDF信息: {pdf_info}")
         
-        # 转换PDF为图片（只执行一次）
-        images = pdf_processor.convert_pdf_to_images(file_path)
-        if not images:
+        # 打开页面流（逐页渲染，不一次性加载全部页面）
+        pages = pdf_processor.open_page_stream(file_path)
+        if not pages:
             raise Exception("PDF转图片失败")
         
-        api_logger.info(f"PDF转图片完成，共{len(images)}页")
+        api_logger.info(f"PDF页面流已打开，共{len(pages)}页")
         
         # 第一步：组合处理（OCR + VLM）- 使用已转换的图片
         api_logger.info(f"开始组合文本提取: {file_id}")
         pdf_case.status = "processing"
         db.commit()
         
-        # 使用新的组合处理方法，传入已转换的图片
-        combined_result = await pdf_processor.extract_text_combined_with_images(pdf_info, images)
+        # VLM流式输出的部分结果及已完成页面定期写入processing_details，详情页无需等待整份文档处理完成
+        vlm_progress_pages = {}
+        last_progress_save = [0.0]
+        
+        def on_vlm_progress(record):
+            vlm_progress_pages[record["page_num"]] = record
+            now = time.monotonic()
+            if now - last_progress_save[0] < VLM_PROGRESS_SAVE_INTERVAL:
+                return
+            last_progress_save[0] = now
+            try:
+                pdf_case.processing_details = {
+                    **(pdf_case.processing_details or {}),
+                    "vlm_pages": [vlm_progress_pages[n] for n in sorted(vlm_progress_pages)]
+                }
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                api_logger.warning(f"保存VLM部分结果失败: {file_id} - {str(e)}")
+        
+        # 使用新的组合处理方法，传入页面流
+        combined_result = await pdf_processor.extract_text_combined_with_images(pdf_info, pages, on_vlm_progress=on_vlm_progress)
         
         api_logger.info(f"组合文本提取完成: {file_id}")
         api_logger.debug(f"OCR成功: {combined_result['ocr_result'].get('success', False)}")
@@ -265,11 +296,13 @@ async def process_pdf_background(file_id: str, file_path: str):
         ocr_summary = combined_result['ocr_result'].get('summary', '')
         vlm_summary = combined_result['vlm_result'].get('summary', '')
         
+        llm_stats = {}
         extracted_info = await ai_extractor.extract_evidence_info(
             ocr_summary, 
             vlm_summary, 
             extraction_fields=extraction_fields,
-            custom_prompt=custom_prompt
+            custom_prompt=custom_prompt,
+            stats=llm_stats
         )
         
         api_logger.info(f"LLM信息提取完成: {file_id}")
@@ -286,11 +319,21 @@ async def process_pdf_background(file_id: str, file_path: str):
             "vlm_pages": combined_result['vlm_result'].get('pages', []),
             "ocr_stats": {
                 "total_pages": combined_result['ocr_result'].get('total_pages', 0),
-                "successful_pages": combined_result['ocr_result'].get('successful_pages', 0)
+                "successful_pages": combined_result['ocr_result'].get('successful_pages', 0),
+                "text_layer_pages": combined_result['ocr_result'].get('text_layer_pages', 0),
+                "cached_pages": combined_result['ocr_result'].get('cached_pages', 0),
+                "blank_pages": combined_result['ocr_result'].get('blank_pages', 0),
+                "duplicate_pages": combined_result['ocr_result'].get('duplicate_pages', 0)
             },
             "vlm_stats": {
                 "total_pages": combined_result['vlm_result'].get('total_pages', 0),
-                "successful_pages": combined_result['vlm_result'].get('successful_pages', 0)
+                "successful_pages": combined_result['vlm_result'].get('successful_pages', 0),
+                "truncated_pages": combined_result['vlm_result'].get('truncated_pages', 0),
+                "cached_pages": combined_result['vlm_result'].get('cached_pages', 0)
+            },
+            "llm_stats": {
+                **llm_stats,
+                "cache_hit": llm_stats.get("cache_hits", 0) > 0 and llm_stats.get("llm_calls", 0) == 0
             }
         }
         
@@ -550,6 +593,20 @@ async def get_case_page_detail(case_id: str, page_num: int, db: SessionLocal = D
         "vlm_result": vlm_page
     }
 
+@app.get("/api/cases/{case_id}/pages/{page_num}/thumbnail")
+async def get_case_page_thumbnail(case_id: str, page_num: int, db: SessionLocal = Depends(get_db)):
+    """获取案例特定页面的缩略图（优先读取页面图片缓存）"""
+    case = db.query(PDFCase).filter(PDFCase.id == case_id).first()
+    if not case:
+        raise HTTPException(status_code=404, detail="案例未找到")
+    
+    pdf_path = os.path.join("uploads", case.file_path)
+    thumbnail = await run_in_threadpool(pdf_processor.get_page_thumbnail, pdf_path, page_num)
+    if thumbnail is None:
+        raise HTTPException(status_code=404, detail=f"第{page_num}页未找到")
+    
+    return Response(content=thumbnail, media_type="image/png")
+
 @app.post("/api/export-all-cases-excel")
 async def export_all_cases_excel(db: SessionLocal = Depends(get_db)):
     """导出所有已完成案例的提取信息到Excel文件"""
@@ -636,6 +693,18 @@ async def clear_all_cases(db: SessionLocal = Depends(get_db)):
         api_logger.error(f"错误详情: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"清空数据失败: {str(e)}")
 
+@app.delete("/api/cache/vlm")
+async def invalidate_vlm_cache(model: Optional[str] = None):
+    """使指定模型（默认当前VLM模型）的VLM结果缓存失效"""
+    try:
+        model = model or pdf_processor.vlm_model
+        generation = await run_in_threadpool(pdf_processor.invalidate_vlm_cache, model)
+        api_logger.info(f"VLM缓存已失效: {model}")
+        return {"message": f"模型 {model} 的VLM缓存已失效", "model": model, "generation": generation}
+    except Exception as e:
+        api_logger.error(f"VLM缓存失效失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"VLM缓存失效失败: {str(e)}")
+
 @app.get("/api/default-config")
 async def get_default_config(db: SessionLocal = Depends(get_db)):
     """获取默认提取配置"""
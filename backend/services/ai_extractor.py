@@ -1,16 +1,25 @@
 import os
 import json
+import asyncio
+import hashlib
+import time
 # import httpx # Removed httpx
 import traceback
-from typing import Dict, Any, Optional as PyOptional, List, Type # PyOptional to avoid conflict, Type for Pydantic model
+from typing import Dict, Any, Optional as PyOptional, List # PyOptional to avoid conflict
 import sys
 # import os # Removed redundant import
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from logger import ai_logger
+from services.http_client import get_http_client, api_base_url
+from services.llm_chunking import estimate_tokens, build_windows, merge_field_values
+from services.disk_cache import DiskCache
 import openai # Added openai
-from openai import APIError, APIConnectionError, RateLimitError, APIStatusError, APITimeoutError # Added specific OpenAI errors
-from pydantic import create_model, BaseModel, Field, ValidationError # Added Pydantic components
-from datetime import date, datetime # Added date and datetime for type mapping
+from openai import APIError, APIConnectionError, RateLimitError, APIStatusError, APITimeoutError, BadRequestError # Added specific OpenAI errors
+from pydantic import ValidationError # Added Pydantic components
+from services.schema_registry import SchemaRegistry, CompiledSchema, canonical_fields
+
+# 结构化输出模式，按约束从强到弱排列（不支持时依次降级）
+STRUCTURED_OUTPUT_MODES = ("json_schema", "json_object", "off")
 
 class AIExtractor:
     """AI信息提取器，使用LLM从文本中提取结构化信息"""
@@ -19,22 +28,45 @@ class AIExtractor:
         ai_logger.info("初始化AI信息提取器")
         
         self.api_key = os.getenv("OPENAI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-        self.base_url = os.getenv("OPENAI_API_BASE", "https://api.openai.com")
+        self.base_url = api_base_url(os.getenv("OPENAI_API_BASE", "https://api.openai.com"))
         
         self.llm_model = os.getenv("LLM_MODEL", "gemini-2.0-flash-exp")
         self.vlm_model = os.getenv("VLM_MODEL", "gemini-2.0-flash-exp")
         
         self.openai_client: PyOptional[openai.AsyncOpenAI] = None
+        
+        # 分块提取：提示词超过该token数时按页面边界切分为多个窗口并发提取，再按字段合并（设为0关闭）
+        self.max_input_tokens = int(os.getenv("LLM_MAX_INPUT_TOKENS", "30000"))
+        self.map_concurrency = max(1, int(os.getenv("LLM_MAP_CONCURRENCY", "4")))
+        
+        # 提取字段编译缓存（Pydantic模型 + JSON Schema），每个模板字段版本只编译一次
+        self.schema_registry = SchemaRegistry()
+        # 结构化输出模式：json_schema（按字段Schema约束输出）、json_object（只要求JSON）、off（提示词约束后解析）
+        self.structured_output = os.getenv("LLM_STRUCTURED_OUTPUT", "json_schema").lower()
+        if self.structured_output not in STRUCTURED_OUTPUT_MODES:
+            ai_logger.warning(f"不支持的结构化输出模式 {self.structured_output}，使用json_schema")
+            self.structured_output = "json_schema"
+        # 不支持所配置结构化输出模式的模型及其降级后的模式
+        self._structured_output_by_model: Dict[str, str] = {}
+        
+        # 提取结果缓存：按文本、字段定义、提示词和模型的规范化哈希寻址，只缓存通过验证的结果（容量设为0关闭）
+        self.extraction_cache = DiskCache(
+            os.getenv("LLM_CACHE_DIR", os.path.join("cache", "llm")),
+            int(float(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024),
+            name="llm_cache"
+        )
 
         if not self.api_key:
             ai_logger.warning("API密钥未配置，OpenAI客户端将不会被初始化，AI服务可能不可用。")
         else:
             ai_logger.info(f"API密钥已配置。Base URL: {self.base_url}")
             try:
+                # 与VLM请求共用进程内的HTTP连接池（HTTP/2 + keep-alive）
                 self.openai_client = openai.AsyncOpenAI(
                     api_key=self.api_key,
                     base_url=self.base_url,
-                    timeout=60.0 
+                    timeout=60.0,
+                    http_client=get_http_client()
                 )
                 ai_logger.info("OpenAI异步客户端已成功初始化。")
             except Exception as e:
@@ -85,21 +117,24 @@ class AIExtractor:
         ocr_text: str, 
         vlm_text: str, 
         extraction_fields: PyOptional[List[Dict]] = None,
-        custom_prompt: PyOptional[str] = None
+        custom_prompt: PyOptional[str] = None,
+        stats: PyOptional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
-        """从OCR和VLM文本中提取证据材料信息"""
+        """从OCR和VLM文本中提取证据材料信息，stats用于接收调用统计（LLM调用次数、缓存命中次数、窗口数）"""
+        if stats is not None:
+            stats.update(llm_calls=0, cache_hits=0, windows=1)
         try:
-            combined_text = f"""
-            百度OCR识别结果：
-            {ocr_text}
-            
-            Gemini VLM分析结果：
-            {vlm_text}
-            """
+            combined_text = self._combine_texts(ocr_text, vlm_text)
             
             fields = extraction_fields or self.default_extraction_fields
             
-            extracted_info = await self._call_llm_for_extraction(combined_text, fields, custom_prompt)
+            if self.max_input_tokens > 0:
+                prompt_tokens = estimate_tokens(self._build_extraction_prompt("", fields, custom_prompt))
+                budget = max(1000, self.max_input_tokens - prompt_tokens)
+                if estimate_tokens(combined_text) > budget:
+                    return await self._extract_in_windows(ocr_text, vlm_text, fields, custom_prompt, budget, stats)
+            
+            extracted_info = await self._call_llm_for_extraction(combined_text, fields, custom_prompt, stats)
             return extracted_info
             
         except Exception as e:
@@ -107,62 +142,88 @@ class AIExtractor:
             ai_logger.error(f"错误详情: {traceback.format_exc()}")
             return {"error": f"信息提取失败: {str(e)}"}
 
-    def _create_pydantic_model_from_fields(self, model_name: str, fields_config: List[Dict]) -> Type[BaseModel]:
-        """根据字段配置动态创建Pydantic模型"""
-        field_definitions: Dict[str, Any] = {}
-        for field_conf in fields_config:
-            key = field_conf.get("key")
-            if not key:
-                ai_logger.warning(f"字段配置中缺少'key': {field_conf}")
-                continue
-
-            label = field_conf.get("label", key) 
-            field_type_str = field_conf.get("type", "text")
-            is_required = field_conf.get("required", False)
-
-            python_type: Any 
-            if field_type_str == "text" or field_type_str == "textarea":
-                python_type = str
-            elif field_type_str == "date":
-                python_type = date
-            elif field_type_str == "datetime":
-                python_type = datetime
-            elif field_type_str == "number": # Example for a numeric type
-                python_type = float 
-            else:
-                ai_logger.warning(f"未知的字段类型 '{field_type_str}' for key '{key}',默认为str")
-                python_type = str
+    def _combine_texts(self, ocr_text: str, vlm_text: str) -> str:
+        """组合OCR和VLM文本作为提取输入"""
+        return f"""
+            百度OCR识别结果：
+            {ocr_text}
+            
+            Gemini VLM分析结果：
+            {vlm_text}
+            """
 
-            if is_required:
-                field_definitions[key] = (python_type, Field(..., description=label))
-            else:
-                # For optional fields, Pydantic V2 expects Optional[type] or type | None
-                field_definitions[key] = (PyOptional[python_type], Field(default=None, description=label))
+    async def _extract_in_windows(
+        self,
+        ocr_text: str,
+        vlm_text: str,
+        extraction_fields: List[Dict],
+        custom_prompt: PyOptional[str],
+        budget: int,
+        stats: PyOptional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """分块提取（map-reduce）：按页面边界切分为不超过token预算的窗口，并发提取后按字段定义合并"""
+        windows = build_windows(ocr_text, vlm_text, budget)
+        if stats is not None:
+            stats["windows"] = len(windows)
+        ai_logger.info(f"文本超出上下文预算（{budget} tokens），分为{len(windows)}个窗口提取，并发{self.map_concurrency}")
         
-        # Filter out any problematic field definitions before creating model
-        valid_field_definitions = {k: v for k, v in field_definitions.items() if k}
-        if not valid_field_definitions:
-            # Fallback to a generic model if no valid fields were defined
-            ai_logger.error("无法根据配置创建有效的Pydantic模型，没有有效的字段定义。")
-            return create_model(model_name, __base__=BaseModel) # Return a base model
-
-        return create_model(model_name, **valid_field_definitions)
+        # 单个窗口不一定包含必填字段，窗口结果按全部可选的字段定义验证，必填校验只对合并结果进行
+        window_fields = [{**field, "required": False} for field in extraction_fields]
+        semaphore = asyncio.Semaphore(self.map_concurrency)
+        
+        async def extract_window(window_ocr: str, window_vlm: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._call_llm_for_extraction(self._combine_texts(window_ocr, window_vlm), window_fields, custom_prompt, stats)
+        
+        results = await asyncio.gather(*[extract_window(window_ocr, window_vlm) for window_ocr, window_vlm in windows])
+        
+        succeeded = [result for result in results if "error" not in result]
+        if not succeeded:
+            ai_logger.error(f"全部{len(results)}个窗口提取失败")
+            return results[0] if results else {"error": "没有可提取的文本"}
+        if len(succeeded) < len(results):
+            ai_logger.warning(f"{len(results) - len(succeeded)}/{len(results)}个窗口提取失败，使用其余窗口的结果合并")
+        
+        merged, conflicts = merge_field_values(succeeded, extraction_fields)
+        for key, values in conflicts.items():
+            ai_logger.info(f"字段 {key} 在各窗口中的提取结果不一致: {values}，取出现次数最多的值: {merged[key]}")
+        
+        DynamicModel = self.schema_registry.get(extraction_fields).model
+        try:
+            return DynamicModel.model_validate(merged).model_dump(mode='json')
+        except ValidationError as e:
+            ai_logger.error(f"合并结果未能通过Pydantic模型验证: {e.errors()}")
+            return {"error": "LLM返回结果未能通过结构化验证", "details": e.errors(include_url=False, include_context=False), "raw_content": merged}
 
     async def _call_llm_for_extraction(
         self, 
         text: str, 
         extraction_fields: List[Dict],
-        custom_prompt: PyOptional[str] = None
+        custom_prompt: PyOptional[str] = None,
+        stats: PyOptional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
-        """调用LLM进行信息提取，并使用Pydantic模型验证结果"""
+        """调用LLM进行信息提取，并使用Pydantic模型验证结果；输入完全相同时直接返回缓存的结果"""
         
         prompt = self._build_extraction_prompt(text, extraction_fields, custom_prompt)
         
         if self.openai_client: 
             try:
+                cache_key = self._extraction_cache_key(text, extraction_fields, custom_prompt)
+                cached = await asyncio.to_thread(self._load_cached_extraction, cache_key)
+                if cached is not None:
+                    ai_logger.info(f"命中LLM提取缓存，模型: {self.llm_model}")
+                    if stats is not None:
+                        stats["cache_hits"] += 1
+                    return cached
+                
                 ai_logger.info(f"通过OpenAI客户端调用LLM进行信息提取，模型: {self.llm_model}")
+                if stats is not None:
+                    stats["llm_calls"] += 1
                 # 将 extraction_fields 传递给 _call_openai_compatible_api
-                return await self._call_openai_compatible_api(prompt, self.llm_model, extraction_fields)
+                result = await self._call_openai_compatible_api(prompt, self.llm_model, extraction_fields)
+                if "error" not in result:
+                    await asyncio.to_thread(self._store_cached_extraction, cache_key, result)
+                return result
             except Exception as e: 
                 ai_logger.error(f"调用_call_openai_compatible_api时发生意外错误: {e}")
                 ai_logger.error(f"错误详情: {traceback.format_exc()}")
@@ -172,6 +233,34 @@ class AIExtractor:
             # 模拟结果也应该符合字段定义，但这里为了简单直接返回
             return self._get_mock_extraction_result(extraction_fields)
     
+    def _extraction_cache_key(self, text: str, extraction_fields: List[Dict], custom_prompt: PyOptional[str]) -> str:
+        """提取缓存键：文本、字段定义（只取影响提取的属性）、提示词和模型的规范化JSON的SHA256"""
+        canonical = json.dumps({
+            "text": text,
+            "fields": canonical_fields(extraction_fields),
+            "custom_prompt": custom_prompt or None,
+            "prompt_template": self.default_prompt_template,
+            "model": self.llm_model
+        }, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return f"llm:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+    def _load_cached_extraction(self, cache_key: str) -> PyOptional[Dict[str, Any]]:
+        """读取缓存的提取结果，损坏的条目被删除"""
+        data = self.extraction_cache.get(cache_key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)["result"]
+        except (ValueError, KeyError, TypeError) as e:
+            ai_logger.warning(f"LLM提取缓存损坏，重新提取: {e}")
+            self.extraction_cache.delete(cache_key)
+            return None
+
+    def _store_cached_extraction(self, cache_key: str, result: Dict[str, Any]):
+        """写入通过验证的提取结果"""
+        data = json.dumps({"result": result, "model": self.llm_model, "created_at": time.time()}, ensure_ascii=False)
+        self.extraction_cache.set(cache_key, data.encode("utf-8"))
+
     def _build_extraction_prompt(
         self, 
         text: str, 
@@ -219,23 +308,38 @@ class AIExtractor:
             return {"error": "OpenAI客户端未初始化"}
 
         try:
-            ai_logger.debug(f"准备调用OpenAI API。模型: {model}")
+            ai_logger.debug(f"准备调用OpenAI API。模型: {model}, 结构化输出: {self.structured_output}")
+            
+            compiled = self.schema_registry.get(extraction_fields)
+            messages = [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的证据材料信息提取助手，擅长从法律文档中联系上下文来判断事实准确提取结构化信息。下面是OCR的结果，请根据OCR的结果提取信息。"
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
             
-            response = await self.openai_client.chat.completions.create(
-                model=model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的证据材料信息提取助手，擅长从法律文档中联系上下文来判断事实准确提取结构化信息。下面是OCR的结果，请根据OCR的结果提取信息。"
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-            )
+            structured_output = self._structured_output_by_model.get(model, self.structured_output)
+            while True:
+                try:
+                    response = await self.openai_client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        **self._response_format_kwargs(compiled, structured_output)
+                    )
+                    break
+                except BadRequestError as e:
+                    if structured_output == "off" or not self._is_response_format_error(e):
+                        raise
+                    # 模型不支持该结构化输出模式时逐级降级（json_schema -> json_object -> off），之后该模型直接使用降级后的模式
+                    downgraded = STRUCTURED_OUTPUT_MODES[STRUCTURED_OUTPUT_MODES.index(structured_output) + 1]
+                    ai_logger.warning(f"模型 {model} 不支持结构化输出模式 {structured_output}，降级为 {downgraded}: {e}")
+                    self._structured_output_by_model[model] = structured_output = downgraded
             
-            content = response.choices[0].message.content.replace("```json", "").replace("```", "")
+            content = response.choices[0].message.content
             
             if not content:
                 ai_logger.warning("API调用成功，但返回内容为空。")
@@ -243,39 +347,23 @@ class AIExtractor:
 
             ai_logger.debug(f"API成功返回内容，长度: {len(content)}")
             
-            parsed_result: Dict[str, Any] = {}
-            try:
-                parsed_result = json.loads(content)
-                ai_logger.info("成功初步解析API返回的JSON响应。")
-                ai_logger.debug("初步解析后的JSON: %s", parsed_result)
-                
-            except json.JSONDecodeError:
-                ai_logger.warning("直接解析API返回内容为JSON失败，尝试提取JSON部分。")
-                import re
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    extracted_json_str = json_match.group()
-                    try:
-                        parsed_result = json.loads(extracted_json_str)
-                        ai_logger.info("从API响应中成功提取并初步解析JSON。")
-                        ai_logger.debug("提取并初步解析后的JSON: %s", parsed_result)
-                    except json.JSONDecodeError as extraction_error:
-                        ai_logger.error(f"从响应中提取的JSON字符串无法解析: {extraction_error}. 提取内容: {extracted_json_str}")
-                        return {"error": f"API返回内容中的JSON部分格式错误: {extraction_error}", "raw_content": content}
-                else:
-                    ai_logger.error("无法从API响应中找到有效的JSON块。原始响应内容已记录到debug级别。")
-                    ai_logger.debug(f"原始非JSON响应内容: {content}")
-                    return {"error": "API返回内容非JSON格式，且未找到JSON块", "raw_content": content}
+            if structured_output == "off":
+                parsed_result = self._parse_json_content(content)
+                if "error" in parsed_result:
+                    return parsed_result
+                validate = lambda: compiled.model.model_validate(parsed_result)
+            else:
+                # 结构化输出直接按编译好的模型解析和验证JSON
+                parsed_result = content
+                validate = lambda: compiled.model.model_validate_json(content)
             
-            # 使用Pydantic模型进行验证和结构化
-            DynamicModel = self._create_pydantic_model_from_fields("ExtractedDataModel", extraction_fields)
             try:
-                validated_data = DynamicModel.model_validate(parsed_result)
+                validated_data = validate()
                 ai_logger.info("Pydantic模型验证和类型转换成功。")
                 return validated_data.model_dump(mode='json') # Ensure JSON serializable types
             except ValidationError as e:
                 ai_logger.error(f"Pydantic模型验证失败: {e.errors()}") # Log Pydantic error details
-                return {"error": "LLM返回结果未能通过结构化验证", "details": e.errors(), "raw_content": parsed_result}
+                return {"error": "LLM返回结果未能通过结构化验证", "details": e.errors(include_url=False, include_context=False), "raw_content": parsed_result}
         
         except APIConnectionError as e:
             ai_logger.error(f"OpenAI API连接错误: {e}")
@@ -298,6 +386,45 @@ class AIExtractor:
             ai_logger.error(f"详细堆栈跟踪: {traceback.format_exc()}")
             return {"error": f"调用API时发生未知内部错误: {str(e)}"}
 
+    @staticmethod
+    def _is_response_format_error(error: BadRequestError) -> bool:
+        """判断400错误是否由结构化输出参数引起（上下文超长、内容过滤等其他错误不降级）"""
+        detail = f"{error.message} {error.body}".lower()
+        return any(keyword in detail for keyword in ("response_format", "json_schema", "json_object", "structured output"))
+
+    def _response_format_kwargs(self, compiled: CompiledSchema, structured_output: str) -> Dict[str, Any]:
+        """结构化输出参数：json_schema使用编译好的Schema约束输出，json_object只要求返回JSON"""
+        if structured_output == "json_schema":
+            return {"response_format": compiled.response_format()}
+        if structured_output == "json_object":
+            return {"response_format": {"type": "json_object"}}
+        return {}
+
+    def _parse_json_content(self, content: str) -> Dict[str, Any]:
+        """未启用结构化输出时解析提示词约束的JSON：去掉代码块标记，失败时提取首尾花括号之间的内容"""
+        content = content.replace("```json", "").replace("```", "")
+        try:
+            parsed_result = json.loads(content)
+            ai_logger.info("成功初步解析API返回的JSON响应。")
+            ai_logger.debug("初步解析后的JSON: %s", parsed_result)
+            return parsed_result
+        except json.JSONDecodeError:
+            ai_logger.warning("直接解析API返回内容为JSON失败，尝试提取JSON部分。")
+        
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            ai_logger.error("无法从API响应中找到有效的JSON块。原始响应内容已记录到debug级别。")
+            ai_logger.debug(f"原始非JSON响应内容: {content}")
+            return {"error": "API返回内容非JSON格式，且未找到JSON块", "raw_content": content}
+        extracted_json_str = content[start:end + 1]
+        try:
+            parsed_result = json.loads(extracted_json_str)
+            ai_logger.info("从API响应中成功提取并初步解析JSON。")
+            return parsed_result
+        except json.JSONDecodeError as extraction_error:
+            ai_logger.error(f"从响应中提取的JSON字符串无法解析: {extraction_error}. 提取内容: {extracted_json_str}")
+            return {"error": f"API返回内容中的JSON部分格式错误: {extraction_error}", "raw_content": content}
+
     def _get_mock_extraction_result(self, extraction_fields: List[Dict]) -> Dict[str, Any]:
         """返回模拟的提取结果（用于测试）"""
         mock_data = {
@@ -317,7 +444,7 @@ class AIExtractor:
         
         # 根据配置的字段返回对应的模拟数据，并尝试做类型转换
         result = {}
-        DynamicModel = self._create_pydantic_model_from_fields("MockExtractedDataModel", extraction_fields)
+        DynamicModel = self.schema_registry.get(extraction_fields).model
         
         # Create a temp dict with only keys present in mock_data that are also in the model
         data_to_validate = {}
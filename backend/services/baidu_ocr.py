@@ -0,0 +1,261 @@
+import os
+import time
+import asyncio
+from bisect import bisect_right
+from typing import Dict, Any, Optional, List, Tuple
+import httpx
+from PIL import Image
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import pdf_logger
+from services.rate_limiter import AsyncTokenBucket, get_rate_limiter
+from services.rasterizer import encode_image_base64
+
+
+class BaiduOCRError(Exception):
+    """百度OCR接口返回的业务错误"""
+
+    def __init__(self, message: str, error_code: Any = None):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+# access_token无效或过期的错误码
+TOKEN_ERROR_CODES = {110, 111}
+
+# 百度OCR图片限制：base64编码后不超过10MB，最长边不超过8192像素
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_IMAGE_SIDE = 8192
+# 多页拼接时的页间留白像素
+STITCH_GAP = 32
+
+
+def stitch_images(images: List[Image.Image], gap: int = STITCH_GAP) -> Tuple[Image.Image, List[int]]:
+    """把多页图片纵向拼接为一张（页间留白），返回拼接图与每页的起始纵坐标"""
+    mode = images[0].mode
+    width = max(image.width for image in images)
+    height = sum(image.height for image in images) + gap * (len(images) - 1)
+    canvas = Image.new(mode, (width, height), "white")
+    offsets = []
+    top = 0
+    for image in images:
+        canvas.paste(image if image.mode == mode else image.convert(mode), (0, top))
+        offsets.append(top)
+        top += image.height + gap
+    return canvas, offsets
+
+
+def split_words_result(result: Dict[str, Any], offsets: List[int]) -> List[Dict[str, Any]]:
+    """按文字行中心的纵坐标把拼接图的识别结果拆回各页，位置换算为页面内坐标"""
+    if result.get('direction', 0) not in (0, -1):
+        raise BaiduOCRError(f"拼接图被识别为旋转方向{result.get('direction')}，无法按位置拆分")
+
+    pages = [[] for _ in offsets]
+    for item in result.get('words_result', []):
+        location = item.get('location')
+        if not location:
+            raise BaiduOCRError("识别结果缺少位置信息，无法按页拆分")
+        center = location['top'] + location.get('height', 0) / 2
+        index = max(0, bisect_right(offsets, center) - 1)
+        pages[index].append({**item, 'location': {**location, 'top': location['top'] - offsets[index]}})
+    return [{'words_result': words, 'words_result_num': len(words)} for words in pages]
+
+
+class BaiduOCRClient:
+    """百度OCR异步客户端：复用长连接（连接池 + keep-alive），按接口共享令牌桶限流"""
+
+    TOKEN_URL = "https://aip.baidubce.com/oauth/2.0/token"
+    OCR_URL = "https://aip.baidubce.com/rest/2.0/ocr/v1/{endpoint}"
+    DEFAULT_OPTIONS = {
+        'detect_direction': 'true',
+        'paragraph': 'true',
+        'probability': 'true'
+    }
+
+    def __init__(self, api_key: str = None, secret_key: str = None, endpoint: str = "handwriting",
+                 qps: float = 1.0, burst: int = 1, timeout: float = 30.0, max_connections: int = 10,
+                 token_refresh_margin: float = 86400.0, options: Dict[str, str] = None):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.endpoint = endpoint
+        self.qps = qps
+        self.burst = burst
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.options = {**self.DEFAULT_OPTIONS, **(options or {})}
+        # 在过期前token_refresh_margin秒主动刷新（不超过有效期的十分之一）
+        self.token_refresh_margin = token_refresh_margin
+        self.access_token: Optional[str] = None
+        self._token_refresh_at = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key and self.secret_key)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """延迟创建共享的HTTP客户端"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0
+                )
+            )
+            pdf_logger.info(f"创建百度OCR HTTP客户端，最大连接数: {self.max_connections}")
+        return self._client
+
+    def get_limiter(self, endpoint: str = None) -> AsyncTokenBucket:
+        """获取接口的共享限流器，接口级配置（如BAIDU_OCR_QPS_HANDWRITING）优先于全局配置"""
+        endpoint = endpoint or self.endpoint
+        suffix = endpoint.upper()
+        rate = float(os.getenv(f"BAIDU_OCR_QPS_{suffix}", self.qps))
+        burst = int(os.getenv(f"BAIDU_OCR_BURST_{suffix}", self.burst))
+        return get_rate_limiter(f"baidu_ocr:{endpoint}", rate, burst)
+
+    def _token_valid(self) -> bool:
+        return bool(self.access_token) and time.monotonic() < self._token_refresh_at
+
+    async def get_access_token(self) -> str:
+        """获取百度API的access_token，临近过期时自动刷新；并发刷新合并为一次请求"""
+        if self._token_valid():
+            pdf_logger.debug("使用缓存的百度access_token")
+            return self.access_token
+
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            # 等锁期间其他任务可能已完成刷新
+            if self._token_valid():
+                return self.access_token
+            return await self._fetch_access_token()
+
+    async def _fetch_access_token(self) -> str:
+        """请求新的access_token并记录刷新时间"""
+        pdf_logger.info("开始获取百度API access_token")
+        if not self.configured:
+            raise Exception("百度API密钥未配置")
+
+        params = {
+            "grant_type": "client_credentials",
+            "client_id": self.api_key,
+            "client_secret": self.secret_key
+        }
+        response = await self._get_client().post(self.TOKEN_URL, params=params)
+        pdf_logger.debug(f"百度token响应状态码: {response.status_code}")
+
+        if response.status_code != 200:
+            raise Exception(f"获取access_token失败: {response.status_code}, {response.text}")
+
+        result = response.json()
+        access_token = result.get("access_token")
+        if not access_token:
+            raise Exception(f"响应中未找到access_token: {result}")
+
+        expires_in = float(result.get("expires_in", 2592000))
+        margin = min(self.token_refresh_margin, expires_in * 0.1)
+        self.access_token = access_token
+        self._token_refresh_at = time.monotonic() + expires_in - margin
+
+        pdf_logger.info(f"百度access_token获取成功，有效期: {expires_in / 86400:.1f}天")
+        return self.access_token
+
+    def invalidate_access_token(self, access_token: str):
+        """标记access_token失效，仅当其仍是当前token时生效，避免重复刷新"""
+        if access_token and access_token == self.access_token:
+            self._token_refresh_at = 0.0
+
+    async def recognize(self, image_base64: str, access_token: str = None, endpoint: str = None,
+                        options: Dict[str, str] = None, timeout: float = None) -> Dict[str, Any]:
+        """识别单张图片，返回百度OCR原始结果（包含words_result）；token失效时刷新后重试一次"""
+        endpoint = endpoint or self.endpoint
+        access_token = access_token or await self.get_access_token()
+        try:
+            return await self._recognize(image_base64, access_token, endpoint, options, timeout)
+        except BaiduOCRError as e:
+            if e.error_code not in TOKEN_ERROR_CODES:
+                raise
+            pdf_logger.warning(f"百度access_token失效（错误码={e.error_code}），刷新后重试")
+            self.invalidate_access_token(access_token)
+            access_token = await self.get_access_token()
+            return await self._recognize(image_base64, access_token, endpoint, options, timeout)
+
+    async def _recognize(self, image_base64: str, access_token: str, endpoint: str,
+                         options: Dict[str, str] = None, timeout: float = None) -> Dict[str, Any]:
+        """发送一次OCR请求"""
+        data = {'image': image_base64, **self.request_options(options)}
+
+        # QPS控制：异步等待令牌，不阻塞事件循环
+        await self.get_limiter(endpoint).acquire()
+
+        response = await self._get_client().post(
+            self.OCR_URL.format(endpoint=endpoint),
+            params={"access_token": access_token},
+            data=data,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        )
+
+        if response.status_code != 200:
+            pdf_logger.error(f"百度OCR API调用失败: 状态码={response.status_code}, 响应={response.text}")
+            raise Exception(f"百度OCR API调用失败: {response.status_code}, {response.text}")
+
+        result = response.json()
+        if 'words_result' not in result:
+            error_msg = result.get('error_msg', '未知错误')
+            error_code = result.get('error_code', '未知错误码')
+            pdf_logger.error(f"OCR识别失败: 错误码={error_code}, 错误信息={error_msg}")
+            raise BaiduOCRError(f"OCR识别失败: 错误码={error_code}, 错误信息={error_msg}", error_code)
+        return result
+
+    async def recognize_pages(self, images: List[Image.Image], image_format: str = "PNG",
+                              access_token: str = None) -> List[Dict[str, Any]]:
+        """多页合并为一次请求：纵向拼接后识别，再按位置拆分为每页的结果（顺序与images一致）"""
+        canvas, offsets = await asyncio.to_thread(stitch_images, images)
+        if max(canvas.size) > MAX_IMAGE_SIDE:
+            raise BaiduOCRError(f"拼接图尺寸{canvas.size}超过{MAX_IMAGE_SIDE}像素限制")
+
+        image_base64 = await asyncio.to_thread(encode_image_base64, canvas, image_format)
+        if len(image_base64) > MAX_IMAGE_BYTES:
+            raise BaiduOCRError(f"拼接图编码后{len(image_base64) // 1024}KB，超过大小限制")
+
+        result = await self.recognize(image_base64, access_token)
+        return split_words_result(result, offsets)
+
+    def request_options(self, options: Dict[str, str] = None) -> Dict[str, str]:
+        """本次请求实际使用的识别参数"""
+        return {**self.options, **(options or {})}
+
+    @staticmethod
+    def extract_text(result: Dict[str, Any]) -> str:
+        """从OCR结果中提取文本，每行一段"""
+        return '\n'.join(item['words'] for item in result.get('words_result', []))
+
+    @staticmethod
+    def extract_line_confidence(result: Dict[str, Any]) -> List[Optional[float]]:
+        """提取每行文字的识别置信度（probability.average），与文本行一一对应，未返回置信度的行为None"""
+        confidences = []
+        for item in result.get('words_result', []):
+            probability = item.get('probability')
+            average = probability.get('average') if isinstance(probability, dict) else None
+            confidences.append(round(float(average), 4) if average is not None else None)
+        return confidences
+
+    @staticmethod
+    def page_confidence(result: Dict[str, Any]) -> Optional[float]:
+        """页面置信度：各行置信度按字数加权平均，没有置信度数据时返回None"""
+        total = weight = 0.0
+        for item, confidence in zip(result.get('words_result', []), BaiduOCRClient.extract_line_confidence(result)):
+            if confidence is not None:
+                length = max(1, len(item.get('words', '')))
+                total += confidence * length
+                weight += length
+        return round(total / weight, 4) if weight else None
+
+    async def aclose(self):
+        """关闭HTTP客户端"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
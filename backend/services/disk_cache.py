@@ -0,0 +1,154 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Tuple
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import logger
+
+
+# 文件哈希记忆：路径 -> ((大小, 修改时间), 哈希)，文件未变化时不再重新读取整个文件
+_FILE_HASH_MEMO_SIZE = 256
+_file_hashes: "OrderedDict[str, Tuple[Tuple[int, int], str]]" = OrderedDict()
+_file_hashes_lock = threading.Lock()
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA256，用作内容寻址的缓存键；按路径、大小和修改时间记忆结果"""
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        memo = _file_hashes.get(path)
+        if memo is not None and memo[0] == signature:
+            _file_hashes.move_to_end(path)
+            return memo[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    file_hash = digest.hexdigest()
+
+    with _file_hashes_lock:
+        _file_hashes[path] = (signature, file_hash)
+        _file_hashes.move_to_end(path)
+        while len(_file_hashes) > _FILE_HASH_MEMO_SIZE:
+            _file_hashes.popitem(last=False)
+    return file_hash
+
+
+class DiskCache:
+    """基于文件的持久化缓存，键哈希后存为单独文件，超过容量上限时按最近使用时间（LRU）淘汰"""
+
+    def __init__(self, directory: str, max_bytes: int, name: str = "cache"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.name = name
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            logger.info(f"[{self.name}] 磁盘缓存目录: {self.directory}, 容量上限: {self.max_bytes // (1024 * 1024)}MB")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.bin")
+
+    def contains(self, key: str) -> bool:
+        return self.enabled and os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存，命中时刷新访问时间"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"[{self.name}] 读取缓存失败: {e}")
+            return None
+
+    def set(self, key: str, data: bytes):
+        """写入缓存（先写临时文件再原子替换），超出容量时淘汰最久未使用的条目"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[{self.name}] 写入缓存失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str):
+        """删除单个缓存条目"""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """列出所有缓存文件 (访问时间, 大小, 路径)"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                if not file_name.endswith(".bin"):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """按最近使用时间淘汰，直到占用降到上限的90%"""
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                continue
+        self._total_bytes = total
+        logger.info(f"[{self.name}] 缓存淘汰{removed}个条目，当前占用: {total // (1024 * 1024)}MB")
@@ -0,0 +1,44 @@
+import os
+import re
+import hashlib
+from typing import Dict, List, Optional, Tuple
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.image_preprocess import PageFingerprint
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def same_text(text: str, other: str) -> bool:
+    """两页识别文本是否相同（忽略空白和换行差异），空文本不视为相同"""
+    text, other = _WHITESPACE.sub("", text or ""), _WHITESPACE.sub("", other or "")
+    return bool(text) and text == other
+
+
+class DuplicatePageIndex:
+    """文档内重复页索引
+
+    文字层页面按文本哈希精确匹配，直接确认重复；其他页面按感知哈希查找候选页，候选页仍需OCR，
+    识别文本与候选页相同（same_text）才确认重复：感知哈希分辨不出小字里个别数字的差异。
+    """
+
+    def __init__(self, max_distance: int = 10, max_candidates: int = 3):
+        self.max_distance = max_distance
+        self.max_candidates = max(1, max_candidates)
+        self._texts: Dict[str, int] = {}
+        self._fingerprints: List[Tuple[PageFingerprint, int]] = []
+
+    def check_text(self, page_num: int, text_layer: str) -> Optional[int]:
+        """查找文字层文本相同的已出现页面并返回其页码，不重复时把当前页加入索引"""
+        text_hash = hashlib.sha256(text_layer.encode("utf-8")).hexdigest()
+        duplicate_of = self._texts.setdefault(text_hash, page_num)
+        return duplicate_of if duplicate_of != page_num else None
+
+    def candidates(self, page_num: int, fingerprint: Optional[PageFingerprint]) -> List[int]:
+        """查找指纹相近的已出现页面，按哈希距离返回最接近的max_candidates个页码，并把当前页加入索引"""
+        if fingerprint is None:
+            return []
+        found = sorted((seen.distance(fingerprint), seen_page_num) for seen, seen_page_num in self._fingerprints
+                       if seen.matches(fingerprint, self.max_distance))
+        self._fingerprints.append((fingerprint, page_num))
+        return [seen_page_num for _, seen_page_num in found[:self.max_candidates]]
@@ -0,0 +1,56 @@
+import os
+from typing import Optional
+from urllib.parse import urlsplit
+import httpx
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import logger
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2需要安装h2（httpx[http2]），未安装时退回HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def api_base_url(base_url: str) -> str:
+    """OpenAI兼容接口的基础地址（OPENAI_API_BASE）：与OpenAI客户端一致，接口路径直接拼接在其后；只配置了域名时补上/v1"""
+    base_url = base_url.rstrip("/")
+    return base_url if urlsplit(base_url).path else f"{base_url}/v1"
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取进程内共享的HTTP客户端，VLM与LLM请求共用连接池（HTTP/2多路复用 + keep-alive）"""
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = os.getenv("HTTP2_ENABLED", "1") != "0"
+        if http2 and not _http2_available():
+            logger.warning("未安装h2，共享HTTP客户端使用HTTP/1.1（pip install httpx[http2]）")
+            http2 = False
+
+        max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+        _client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "60")), connect=10.0),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", str(max_connections))),
+                keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+            )
+        )
+        logger.info(f"创建共享HTTP客户端: HTTP/2={'开启' if http2 else '关闭'}, 最大连接数: {max_connections}")
+    return _client
+
+
+async def close_http_client():
+    """关闭共享HTTP客户端"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("共享HTTP客户端已关闭")
+    _client = None
@@ -0,0 +1,236 @@
+import struct
+from typing import Tuple, Sequence, Optional
+import numpy as np
+from PIL import Image
+
+# 支持的预处理步骤
+STEP_CROP = "crop"
+STEP_BINARIZE = "binarize"
+PREPROCESS_STEPS = (STEP_CROP, STEP_BINARIZE)
+
+# 灰度ITU-R BT.601权重
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def pixels_to_array(mode: str, width: int, height: int, stride: int, samples: bytes) -> np.ndarray:
+    """把像素缓冲区包装为数组（灰度为HxW，彩色为HxWxC），不拷贝数据"""
+    channels = len(mode)
+    buffer = np.frombuffer(samples, dtype=np.uint8).reshape(height, stride)
+    array = buffer[:, :width * channels]
+    return array if channels == 1 else array.reshape(height, width, channels)
+
+
+def array_to_pixels(array: np.ndarray) -> Tuple[str, int, int, int, bytes]:
+    """把数组转换回 (模式, 宽, 高, 行跨度, 像素字节)"""
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+    height, width = array.shape[:2]
+    mode = "L" if array.ndim == 2 else {3: "RGB", 4: "RGBA"}[array.shape[2]]
+    return mode, width, height, width * len(mode), array.tobytes()
+
+
+def to_gray(array: np.ndarray) -> np.ndarray:
+    """转换为灰度数组"""
+    if array.ndim == 2:
+        return array
+    return (array[..., :3] @ _GRAY_WEIGHTS).astype(np.uint8)
+
+
+def crop_margins(array: np.ndarray, dark_threshold: int = 200, min_ratio: float = 0.002, padding_ratio: float = 0.02) -> np.ndarray:
+    """裁掉页面四周的空白边距：按行/列统计深色像素数，忽略零星噪点，保留少量留白"""
+    dark = to_gray(array) < dark_threshold
+    height, width = dark.shape
+    rows = np.flatnonzero(dark.sum(axis=1) >= max(2, width * min_ratio))
+    cols = np.flatnonzero(dark.sum(axis=0) >= max(2, height * min_ratio))
+    if rows.size == 0 or cols.size == 0:
+        # 空白页不裁剪，交由空白页检测处理
+        return array
+
+    padding = int(max(height, width) * padding_ratio)
+    top = max(0, rows[0] - padding)
+    bottom = min(height, rows[-1] + 1 + padding)
+    left = max(0, cols[0] - padding)
+    right = min(width, cols[-1] + 1 + padding)
+    return array[top:bottom, left:right]
+
+
+def adaptive_binarize(array: np.ndarray, window: int = 0, sensitivity: float = 0.15) -> np.ndarray:
+    """Bradley自适应二值化：像素比邻域均值暗sensitivity以上时置黑，基于积分图整体向量化计算
+
+    window 为邻域边长，0表示取图片宽度的1/32；光照不均、阴影和纸张底色都会被消除。
+    """
+    gray = to_gray(array)
+    height, width = gray.shape
+    window = window or max(15, width // 32)
+    half = window // 2
+
+    # 积分图（首行首列补零），像素总数较大时使用int64避免溢出
+    dtype = np.uint32 if gray.size < 16_000_000 else np.int64
+    integral = np.zeros((height + 1, width + 1), dtype=dtype)
+    np.cumsum(np.cumsum(gray, axis=0, dtype=dtype), axis=1, out=integral[1:, 1:])
+
+    y0 = np.clip(np.arange(height) - half, 0, height)
+    y1 = np.clip(np.arange(height) + half + 1, 0, height)
+    x0 = np.clip(np.arange(width) - half, 0, width)
+    x1 = np.clip(np.arange(width) + half + 1, 0, width)
+
+    # 先按行、再按列做差得到每个像素的邻域和；比较时的乘积（255 * 邻域面积 * 100）超出int32范围时使用int64
+    max_area = int((y1 - y0).max()) * int((x1 - x0).max())
+    compare_dtype = np.int32 if 255 * max_area * 100 <= np.iinfo(np.int32).max else np.int64
+    row_sums = (integral[y1] - integral[y0]).astype(np.int64)
+    window_sum = (row_sums[:, x1] - row_sums[:, x0]).astype(compare_dtype)
+    area = ((y1 - y0)[:, None] * (x1 - x0)[None, :]).astype(compare_dtype)
+
+    # gray * area <= window_sum * (1 - sensitivity) 视为前景
+    foreground = gray.astype(compare_dtype) * area * 100 <= window_sum * int(round((1 - sensitivity) * 100))
+    return np.where(foreground, 0, 255).astype(np.uint8)
+
+
+def max_cell_ink(array: np.ndarray, contrast: int = 40, cell: int = 16, margin_ratio: float = 0.02) -> float:
+    """局部墨迹占比：按cell x cell像素分块，返回墨迹（比纸张底色暗contrast以上的像素）占比最高的块的占比
+
+    按块而不是整页统计，只有一行字、一个页码或一笔签名的页面也不会被当作空白页；忽略四周很窄的边缘（扫描阴影）。
+    """
+    gray = to_gray(array)
+    height, width = gray.shape
+    dy, dx = int(height * margin_ratio), int(width * margin_ratio)
+    inner = gray[dy:height - dy, dx:width - dx]
+    if inner.size == 0:
+        return 0.0
+    background = int(np.median(inner))
+    ink = inner < background - contrast
+    if not ink.any():
+        return 0.0
+    rows, cols = max(1, inner.shape[0] // cell), max(1, inner.shape[1] // cell)
+    return float(_block_means(ink, rows, cols).max())
+
+
+def _block_means(gray: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """把图片按面积平均缩小为rows x cols"""
+    height, width = gray.shape
+    ys = np.linspace(0, height, rows + 1).astype(np.intp)
+    xs = np.linspace(0, width, cols + 1).astype(np.intp)
+    sums = np.add.reduceat(np.add.reduceat(gray.astype(np.float32), ys[:-1], axis=0), xs[:-1], axis=1)
+    return sums / (np.diff(ys)[:, None] * np.diff(xs)[None, :])
+
+
+def box_blur(gray: np.ndarray) -> np.ndarray:
+    """3x3均值滤波，抑制扫描噪点"""
+    height, width = gray.shape
+    padded = np.pad(gray.astype(np.uint16), 1, mode="edge")
+    total = sum(padded[dy:dy + height, dx:dx + width] for dy in range(3) for dx in range(3))
+    return (total // 9).astype(np.uint8)
+
+
+def estimate_skew(ink: np.ndarray, max_angle: float = 2.0, step: float = 0.1) -> float:
+    """估计倾斜角度（度，逆时针为正）：在±max_angle度内取墨迹投影方差最大（文字行最整齐）的方向
+
+    沿倾斜方向的投影用按列错位累加实现，不插值，各角度的得分可直接比较。
+    """
+    height, width = ink.shape
+    x = np.arange(width) - width / 2
+    ink = ink.astype(np.float32)
+    best_score, best_angle = -1.0, 0.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        shifts = np.round(np.tan(np.radians(angle)) * x).astype(np.intp)
+        # 偏移随列单调变化，偏移相同的列连续，先分组求和再错位累加
+        starts = np.flatnonzero(np.diff(shifts, prepend=shifts[0] - 1))
+        groups = np.add.reduceat(ink, starts, axis=1)
+        offset = int(np.abs(shifts).max())
+        profile = np.zeros(height + 2 * offset, dtype=np.float32)
+        for column, shift in enumerate(shifts[starts]):
+            profile[offset + shift:offset + shift + height] += groups[:, column]
+        score = float(profile.var())
+        if score > best_score:
+            best_score, best_angle = score, round(float(angle), 2)
+    return best_angle
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """DCT-II变换矩阵（未归一化，只比较系数相对大小）"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+class PageFingerprint:
+    """页面感知哈希（pHash）：墨迹密度图纠偏、裁掉空白边距（消除平移和缩放）后缩小为32x32，
+    DCT低频8x8分量（去掉直流分量）相对中位数的符号位
+
+    对轻微倾斜、缩放和扫描噪点不敏感，只用于查找候选重复页：小字里个别数字的差异不会改变哈希，需由识别文本确认。
+    """
+
+    __slots__ = ("phash", "aspect")
+
+    def __init__(self, phash: int, aspect: float):
+        self.phash = phash
+        # 内容区域高宽比，版式相近但排版不同的页面可据此排除
+        self.aspect = aspect
+
+    @classmethod
+    def from_array(cls, array: np.ndarray, ink_threshold: float = 0.01) -> Optional["PageFingerprint"]:
+        """由页面灰度图计算指纹，无内容时返回None"""
+        ink = adaptive_binarize(box_blur(to_gray(array))) == 0
+        if not ink.any():
+            return None
+        # 按一半分辨率估计倾斜角度，缩小为约256像素宽的密度图后反向旋转纠偏
+        height, width = ink.shape
+        density = _block_means(ink, max(1, round(height * 256 / width)), min(256, width))
+        half = ink[:height // 2 * 2, :width // 2 * 2].reshape(height // 2, 2, width // 2, 2).sum(axis=(1, 3), dtype=np.uint8)
+        angle = estimate_skew(half)
+        if angle:
+            density = np.asarray(Image.fromarray(density).rotate(-angle, resample=Image.BILINEAR))
+        rows = np.flatnonzero(density.mean(axis=1) > ink_threshold)
+        cols = np.flatnonzero(density.mean(axis=0) > ink_threshold)
+        if rows.size == 0 or cols.size == 0:
+            return None
+        content = density[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        small = np.asarray(Image.fromarray(content).resize((32, 32), Image.BOX), dtype=np.float64)
+        low = (_DCT_32 @ small @ _DCT_32.T)[:8, :8].flatten()[1:]
+        bits = low > np.median(low)
+        phash = int("".join("1" if bit else "0" for bit in bits), 2)
+        return cls(phash, content.shape[0] / content.shape[1])
+
+    def to_bytes(self) -> bytes:
+        """序列化（写入页面缓存）"""
+        return struct.pack(">Qd", self.phash, self.aspect)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PageFingerprint":
+        return cls(*struct.unpack(">Qd", data))
+
+    def distance(self, other: "PageFingerprint") -> int:
+        """哈希的汉明距离（0-63）"""
+        return bin(self.phash ^ other.phash).count("1")
+
+    def matches(self, other: "PageFingerprint", max_distance: int = 10, max_aspect_diff: float = 0.05) -> bool:
+        """是否为候选重复页：内容区域高宽比相差不超过max_aspect_diff，且哈希距离不超过max_distance"""
+        if abs(self.aspect - other.aspect) > max_aspect_diff * max(self.aspect, other.aspect):
+            return False
+        return self.distance(other) <= max_distance
+
+
+def preprocess_array(array: np.ndarray, steps: Sequence[str]) -> np.ndarray:
+    """按顺序执行预处理步骤（先裁边再二值化，减少计算量）"""
+    if STEP_CROP in steps:
+        array = crop_margins(array)
+    if STEP_BINARIZE in steps:
+        array = adaptive_binarize(array)
+    return array
+
+
+def parse_steps(spec: str) -> Tuple[str, ...]:
+    """解析"crop+binarize"格式的预处理配置，none或空表示不处理"""
+    if not spec or spec.lower() == "none":
+        return ()
+    steps = []
+    for step in spec.lower().split("+"):
+        step = step.strip()
+        if step not in PREPROCESS_STEPS:
+            raise ValueError(f"不支持的预处理步骤: {step}")
+        if step not in steps:
+            steps.append(step)
+    # 固定顺序，保证配置标识稳定
+    return tuple(step for step in PREPROCESS_STEPS if step in steps)
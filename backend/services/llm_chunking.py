@@ -0,0 +1,136 @@
+import re
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+
+# OCR/VLM摘要中的分页标题，如"=== 第3页 ==="、"=== VLM第3页分析 ==="
+_PAGE_HEADING_RE = re.compile(r"^=== (?:VLM)?第(\d+)页(?:分析)? ===$", re.MULTILINE)
+# 中日韩字符（每个字符约1个token）
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中文字符按1个、其他字符按每4个1个计算，偏保守以免超出上下文"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_page_sections(summary: str) -> List[Tuple[int, str]]:
+    """把OCR/VLM摘要按分页标题拆分为 (页码, 含标题的段落)，标题前的内容页码记为0"""
+    sections = []
+    headings = list(_PAGE_HEADING_RE.finditer(summary or ""))
+    if not headings:
+        return [(0, summary.strip())] if summary and summary.strip() else []
+
+    if summary[:headings[0].start()].strip():
+        sections.append((0, summary[:headings[0].start()].strip()))
+    for i, heading in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(summary)
+        sections.append((int(heading.group(1)), summary[heading.start():end].strip()))
+    return sections
+
+
+def _split_oversized(text: str, budget: int) -> List[str]:
+    """把超出预算的单页内容按行切分，单行仍超出时按字符切分"""
+    pieces, current, current_tokens = [], [], 0
+    for line in text.split("\n"):
+        line_tokens = estimate_tokens(line) + 1
+        while line_tokens > budget:
+            # 按预算对应的字符数切分超长行（中文按1字符1token估算，足够保守）
+            head, line = line[:budget], line[budget:]
+            if current:
+                pieces.append("\n".join(current))
+                current, current_tokens = [], 0
+            pieces.append(head)
+            line_tokens = estimate_tokens(line) + 1
+        if current and current_tokens + line_tokens > budget:
+            pieces.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def build_windows(ocr_summary: str, vlm_summary: str, budget: int) -> List[Tuple[str, str]]:
+    """按页面边界把OCR与VLM摘要打包为不超过token预算的窗口，返回 (OCR文本, VLM文本) 列表
+
+    同一页的OCR和VLM结果放在同一窗口中；单页超出预算时按行切分到多个窗口。
+    """
+    pages: Dict[int, Dict[str, List[str]]] = {}
+    for source, summary in (("ocr", ocr_summary), ("vlm", vlm_summary)):
+        for page_num, section in split_page_sections(summary):
+            pages.setdefault(page_num, {"ocr": [], "vlm": []})[source].append(section)
+
+    windows: List[Tuple[str, str]] = []
+    ocr_parts: List[str] = []
+    vlm_parts: List[str] = []
+    used = 0
+
+    def flush():
+        nonlocal ocr_parts, vlm_parts, used
+        if ocr_parts or vlm_parts:
+            windows.append(("\n\n".join(ocr_parts), "\n\n".join(vlm_parts)))
+        ocr_parts, vlm_parts, used = [], [], 0
+
+    for page_num in sorted(pages):
+        ocr_text = "\n\n".join(pages[page_num]["ocr"])
+        vlm_text = "\n\n".join(pages[page_num]["vlm"])
+        tokens = estimate_tokens(ocr_text) + estimate_tokens(vlm_text)
+        if tokens > budget:
+            flush()
+            for source, text in (("ocr", ocr_text), ("vlm", vlm_text)):
+                for piece in _split_oversized(text, budget) if text else []:
+                    windows.append((piece, "") if source == "ocr" else ("", piece))
+            continue
+        if used + tokens > budget:
+            flush()
+        if ocr_text:
+            ocr_parts.append(ocr_text)
+        if vlm_text:
+            vlm_parts.append(vlm_text)
+        used += tokens
+    flush()
+    return windows
+
+
+def merge_field_values(results: List[Dict[str, Any]], extraction_fields: List[Dict]) -> Tuple[Dict[str, Any], Dict[str, List[Any]]]:
+    """按字段定义合并各窗口的提取结果，返回 (合并结果, 存在分歧的字段及其候选值)
+
+    每个字段取各窗口中出现次数最多的非空值，次数相同时取靠前窗口的值；
+    配置了options的字段只接受选项内的值。
+    """
+    merged: Dict[str, Any] = {}
+    conflicts: Dict[str, List[Any]] = {}
+    for field in extraction_fields:
+        key = field.get("key")
+        if not key:
+            continue
+        options = field.get("options")
+        values = []
+        for result in results:
+            value = result.get(key)
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or value == "":
+                continue
+            if options and value not in options:
+                continue
+            values.append(value)
+
+        if not values:
+            merged[key] = None
+            continue
+        counts = Counter(_normalize(value) for value in values)
+        best_count = max(counts.values())
+        merged[key] = next(value for value in values if counts[_normalize(value)] == best_count)
+        if len(counts) > 1:
+            conflicts[key] = list(dict.fromkeys(values))
+    return merged, conflicts
+
+
+def _normalize(value: Any) -> Any:
+    """比较字段值时忽略空白差异"""
+    return re.sub(r"\s+", "", value) if isinstance(value, str) else value
@@ -0,0 +1,110 @@
+import os
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, AsyncIterator
+import fitz  # PyMuPDF
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import pdf_logger
+from services.disk_cache import DiskCache, file_sha256
+from services.rasterizer import RasterEngine, RenderOptions, RenderedPage, PageSource, render_page, decode_pages, cached_skip_map
+
+
+class PageStream:
+    """PDF页面流，按需逐页渲染并限制预取页数，避免一次性把所有页面加载到内存"""
+
+    def __init__(self, pdf_path: str, max_pages: int = None, lookahead: int = 2, engine: RasterEngine = None,
+                 options: RenderOptions = None, cache: DiskCache = None, image_format: str = "PNG"):
+        self.pdf_path = pdf_path
+        self.lookahead = max(1, lookahead)
+        self.engine = engine
+        self.options = options or RenderOptions()
+        self.cache = cache
+        self.image_format = image_format
+        self._source: PageSource = None
+
+        doc = fitz.open(pdf_path)
+        try:
+            self.page_count = len(doc)
+        finally:
+            doc.close()
+
+        self.total_pages = min(self.page_count, max_pages) if max_pages else self.page_count
+        if self.total_pages < self.page_count:
+            pdf_logger.info(f"限制处理页数: {self.total_pages}/{self.page_count}")
+
+    def __len__(self) -> int:
+        return self.total_pages
+
+    def _get_source(self) -> PageSource:
+        """构建页面来源，启用缓存时计算文件哈希作为缓存键"""
+        if self._source is None:
+            file_hash = file_sha256(self.pdf_path) if self.cache is not None and self.cache.enabled else None
+            self._source = PageSource(self.pdf_path, self.options.profiles, self.cache, file_hash, self.image_format)
+        return self._source
+
+    def _render_page(self, doc: fitz.Document, page_index: int, options: RenderOptions) -> RenderedPage:
+        """渲染单页并解码，已缓存的配置不再渲染"""
+        source = self._get_source()
+        skip = cached_skip_map(source, options, page_index, page_index + 1)
+        return decode_pages([render_page(doc, page_index, options, skip.get(page_index, ()))], source)[0]
+
+    def _options_for(self, force_render_pages: int) -> RenderOptions:
+        """生成本次迭代使用的渲染选项"""
+        return RenderOptions(
+            profiles=self.options.profiles,
+            text_layer_min_chars=self.options.text_layer_min_chars,
+            text_layer_min_ratio=self.options.text_layer_min_ratio,
+            text_layer_image_min_area=self.options.text_layer_image_min_area,
+            force_render_pages=force_render_pages,
+            blank_max_ink=self.options.blank_max_ink,
+            page_fingerprint=self.options.page_fingerprint
+        )
+
+    def __iter__(self) -> Iterator[RenderedPage]:
+        """同步逐页迭代"""
+        options = self.options
+        doc = fitz.open(self.pdf_path)
+        try:
+            for page_index in range(self.total_pages):
+                yield self._render_page(doc, page_index, options)
+        finally:
+            doc.close()
+
+    def __aiter__(self) -> AsyncIterator[RenderedPage]:
+        return self.pages()
+
+    async def pages(self, force_render_pages: int = None) -> AsyncIterator[RenderedPage]:
+        """异步逐页迭代，优先使用多进程光栅化引擎，否则在后台线程渲染，最多预取lookahead页
+
+        force_render_pages 指定前N页即使有可用文字层也需要渲染图片。
+        """
+        options = self.options if force_render_pages is None else self._options_for(force_render_pages)
+        loop = asyncio.get_running_loop()
+        # 文件哈希计算放到线程中，避免阻塞事件循环
+        source = await loop.run_in_executor(None, self._get_source)
+
+        if self.engine and self.engine.enabled:
+            async for page in self.engine.iter_pages(source, self.total_pages, options, self.lookahead):
+                yield page
+            return
+
+        # 单线程执行器保证同一文档不会被并发访问
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-render")
+        doc = await loop.run_in_executor(executor, fitz.open, self.pdf_path)
+        pending = deque()
+        next_index = 0
+
+        try:
+            while next_index < self.total_pages or pending:
+                while next_index < self.total_pages and len(pending) < self.lookahead:
+                    pending.append(loop.run_in_executor(executor, self._render_page, doc, next_index, options))
+                    next_index += 1
+
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.submit(doc.close)
+            executor.shutdown(wait=False)
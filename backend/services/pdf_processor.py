@@ -1,21 +1,57 @@
 import os
 import asyncio
 import time
-from typing import List, Optional, Dict, Any
-import pytesseract
+from typing import List, Optional, Dict, Any, Union, AsyncIterator, Callable, Tuple
 import fitz  # PyMuPDF
 from PIL import Image
 import httpx
-import base64
-import io
-import requests
-import urllib.parse
 import json
+import hashlib
+import random
+import re
+import threading
 import traceback
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from logger import pdf_logger
+from services.page_stream import PageStream
+from services.rasterizer import (
+    RasterEngine, RenderOptions, RenderProfile, RenderedPage, encode_image_base64, IMAGE_MIME_TYPES,
+    PageSource, PROFILE_OCR, PROFILE_TESSERACT, PROFILE_VLM, PROFILE_THUMBNAIL
+)
+from services.disk_cache import DiskCache, file_sha256
+from services.baidu_ocr import BaiduOCRClient, MAX_IMAGE_SIDE, STITCH_GAP
+from services.tesseract_pool import TesseractPool
+from services.rate_limiter import get_concurrency_limiter
+from services.http_client import get_http_client, api_base_url
+from services.vlm_pipeline import VLMPipeline
+from services.duplicate_pages import DuplicatePageIndex, same_text
+
+# VLM提示词
+VLM_SYSTEM_PROMPT = "你是一个专业的文档图像分析助手，擅长从证据文档图像中准确识别和提取文字内容。"
+VLM_PAGE_PROMPT = "请仔细分析这个证据文档图像，识别并提取其中的所有文字内容。"
+VLM_BATCH_PROMPT = (
+    "以下是同一份证据文档的{count}张页面图像，每张图像前标注了页码。请逐页仔细分析，识别并提取每页中的所有文字内容。\n"
+    "输出时每页结果必须以单独一行的“<<<第N页>>>”开头（N为该页页码），按页码顺序输出，不同页面的内容不要合并。"
+)
+# 多页VLM结果的分页标记
+VLM_PAGE_MARKER = re.compile(r"^[ \t]*<<<\s*第\s*(\d+)\s*页\s*>>>[ \t]*$", re.MULTILINE)
+# 流式VLM输出回调部分结果的最小间隔（秒）
+VLM_PROGRESS_INTERVAL = 1.0
+
+
+class VLMTimeoutError(Exception):
+    """VLM流式输出超时，partial_text为超时前已生成的内容"""
+
+    def __init__(self, message: str, partial_text: str = ""):
+        super().__init__(message)
+        self.partial_text = partial_text
+
+
+class VLMResponseError(Exception):
+    """VLM返回200但内容无效：流中的错误事件、无法解析的数据或空结果，与传输错误一样重试"""
+
 
 class PDFProcessor:
     """PDF处理器，负责OCR和VLM识别"""
@@ -26,17 +62,121 @@ class PDFProcessor:
         # 百度OCR配置
         self.baidu_api_key = os.getenv("BAIDU_API_KEY")
         self.baidu_secret_key = os.getenv("BAIDU_SECRET_KEY")
-        self.baidu_access_token = None
         
-        # OCR QPS控制
-        self.ocr_last_call_time = 0
-        self.ocr_min_interval = 1.0  # 最小间隔1秒，控制QPS为1
+        # 百度OCR异步客户端：长连接复用，令牌桶控制QPS（所有任务共享；可按接口单独配置，如BAIDU_OCR_QPS_HANDWRITING）
+        self.baidu_ocr = BaiduOCRClient(
+            api_key=self.baidu_api_key,
+            secret_key=self.baidu_secret_key,
+            endpoint=os.getenv("BAIDU_OCR_ENDPOINT", "handwriting"),
+            qps=float(os.getenv("BAIDU_OCR_QPS", "1")),
+            burst=int(os.getenv("BAIDU_OCR_BURST", "1")),
+            timeout=float(os.getenv("BAIDU_OCR_TIMEOUT", "30")),
+            max_connections=int(os.getenv("BAIDU_OCR_MAX_CONNECTIONS", "10")),
+            token_refresh_margin=float(os.getenv("BAIDU_TOKEN_REFRESH_MARGIN", "86400"))
+        )
+        # OCR结果缓存：按页面图片哈希+接口+识别参数寻址，跨文档、跨重新处理复用（设为0关闭）
+        self.ocr_cache = DiskCache(
+            os.getenv("OCR_CACHE_DIR", os.path.join("cache", "ocr")),
+            int(float(os.getenv("OCR_CACHE_MAX_MB", "256")) * 1024 * 1024),
+            name="ocr_cache"
+        )
+        # Tesseract回退进程池（TESSERACT_WORKERS=0时在线程中执行）
+        tesseract_workers = os.getenv("TESSERACT_WORKERS")
+        self.tesseract_pool = TesseractPool(
+            workers=int(tesseract_workers) if tesseract_workers else None,
+            lang=os.getenv("TESSERACT_LANG", "chi_sim+eng")
+        )
+        # 单个任务同时在途的OCR请求数（实际速率仍受令牌桶限制）
+        self.ocr_concurrency = max(1, int(os.getenv("BAIDU_OCR_CONCURRENCY", "4")))
+        # 每次OCR请求合并的页数：多页纵向拼接为一张图提交，再按文字位置拆回各页（1为逐页提交）
+        self.ocr_batch_pages = max(1, int(os.getenv("BAIDU_OCR_BATCH_PAGES", "1")))
         
         # 统一使用OpenAI兼容的API配置
         self.api_key = os.getenv("OPENAI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-        self.base_url = os.getenv("OPENAI_API_BASE", "https://api.ablai.top/v1")
+        # 与LLM的OpenAI客户端按相同规则拼接接口地址
+        self.base_url = api_base_url(os.getenv("OPENAI_API_BASE", "https://api.ablai.top/v1"))
         self.vlm_model = os.getenv("VLM_MODEL", "gemini-2.5-flash-preview-05-20")  # 默认使用Gemini
         
+        # VLM并发控制（所有任务共享，AIMD自适应）及429/5xx重试（指数退避 + 随机抖动）
+        self.vlm_limiter = get_concurrency_limiter(
+            "vlm",
+            initial=int(os.getenv("VLM_CONCURRENCY_INITIAL", "4")),
+            min_limit=int(os.getenv("VLM_CONCURRENCY_MIN", "1")),
+            max_limit=int(os.getenv("VLM_CONCURRENCY_MAX", "16"))
+        )
+        self.vlm_max_retries = int(os.getenv("VLM_MAX_RETRIES", "3"))
+        self.vlm_backoff_base = float(os.getenv("VLM_BACKOFF_BASE", "1"))
+        self.vlm_backoff_max = float(os.getenv("VLM_BACKOFF_MAX", "30"))
+        # 每次VLM请求合并的页数：多页图像放在同一请求中，系统提示词只发送一次，按分页标记拆回各页（1为逐页请求）
+        self.vlm_batch_pages = max(1, int(os.getenv("VLM_BATCH_PAGES", "1")))
+        # 流式接收VLM输出（SSE），单次请求超过VLM_TIMEOUT秒时保留已生成的部分结果并标记为截断
+        self.vlm_stream = os.getenv("VLM_STREAM", "1") != "0"
+        self.vlm_timeout = float(os.getenv("VLM_TIMEOUT", "60"))
+        # VLM结果缓存：按页面图片哈希 + 模型 + 提示词哈希寻址，重新处理和重复上传时不再调用VLM（容量设为0关闭）
+        self.vlm_cache = DiskCache(
+            os.getenv("VLM_CACHE_DIR", os.path.join("cache", "vlm")),
+            int(float(os.getenv("VLM_CACHE_MAX_MB", "256")) * 1024 * 1024),
+            name="vlm_cache"
+        )
+        # VLM缓存有效期（小时），0表示不过期
+        self.vlm_cache_ttl = float(os.getenv("VLM_CACHE_TTL_HOURS", "720")) * 3600
+        self.vlm_prompt_hash = hashlib.sha256("\n".join([VLM_SYSTEM_PROMPT, VLM_PAGE_PROMPT, VLM_BATCH_PROMPT]).encode("utf-8")).hexdigest()[:16]
+        self._vlm_generation_lock = threading.Lock()
+        # VLM页面选择：confidence为OCR完成后优先分析识别失败和置信度最低的页面，first为前N页
+        self.vlm_page_selection = os.getenv("VLM_PAGE_SELECTION", "confidence").lower()
+        if self.vlm_page_selection not in ("confidence", "first"):
+            pdf_logger.warning(f"不支持的VLM页面选择方式 {self.vlm_page_selection}，使用confidence")
+            self.vlm_page_selection = "confidence"
+        # OCR页面置信度达到该值时不需要VLM复核
+        self.vlm_confidence_threshold = float(os.getenv("VLM_CONFIDENCE_THRESHOLD", "0.9"))
+        
+        # 页面流预取页数，限制单个任务同时驻留内存的页面数量
+        self.page_lookahead = int(os.getenv("PDF_PAGE_LOOKAHEAD", "2"))
+        
+        # 多进程光栅化配置，进程数为0时退回单线程渲染
+        raster_workers = os.getenv("RASTER_WORKERS")
+        self.raster_engine = RasterEngine(
+            workers=int(raster_workers) if raster_workers else None,
+            chunk_pages=int(os.getenv("RASTER_CHUNK_PAGES", "2"))
+        )
+        
+        # 文字层检测：有效字符数达到阈值的页面直接使用内嵌文本，不再OCR（设为0关闭）
+        self.text_layer_min_chars = int(os.getenv("TEXT_LAYER_MIN_CHARS", "20"))
+        self.text_layer_min_ratio = float(os.getenv("TEXT_LAYER_MIN_RATIO", "0.8"))
+        # 嵌入图片面积不小于页面该比例的页面（证件复印件、扫描底图）即使有文字层也进行OCR，识别结果与文字层合并（设为0关闭）
+        self.text_layer_image_min_area = float(os.getenv("TEXT_LAYER_IMAGE_MIN_AREA", "0.03"))
+        
+        # 空白页检测：没有文字层、且按100dpi渲染后每个16x16像素小块的墨迹占比都不超过该值的页面跳过OCR和VLM（设为0关闭）
+        self.blank_page_max_ink = float(os.getenv("BLANK_PAGE_MAX_INK", "0.02"))
+        
+        # 重复页检测：文字层页面按文本比对；其他页面按感知哈希（汉明距离不超过该值，设为-1关闭）查找最接近的N个候选页，
+        # 候选页仍需OCR，识别文本相同才复用首次出现页面的OCR/VLM结果
+        self.duplicate_max_distance = int(os.getenv("DUPLICATE_PAGE_MAX_DISTANCE", "10"))
+        self.duplicate_max_candidates = int(os.getenv("DUPLICATE_PAGE_MAX_CANDIDATES", "3"))
+        
+        # 各阶段的渲染配置（"dpi,颜色模式,最长边像素,预处理"），按使用方需要的分辨率渲染，避免超大位图；
+        # OCR图片裁边并自适应二值化以缩小上传体积，VLM图片只裁边保留色彩
+        self.render_profiles = {
+            PROFILE_OCR: RenderProfile.from_spec(os.getenv("RENDER_PROFILE_OCR"), RenderProfile(144, "gray", 4096, ("crop", "binarize"))),
+            PROFILE_TESSERACT: RenderProfile.from_spec(os.getenv("RENDER_PROFILE_TESSERACT"), RenderProfile(300, "gray", 5000, ("crop", "binarize"))),
+            PROFILE_VLM: RenderProfile.from_spec(os.getenv("RENDER_PROFILE_VLM"), RenderProfile(144, "rgb", 1600, ("crop",))),
+            PROFILE_THUMBNAIL: RenderProfile.from_spec(os.getenv("RENDER_PROFILE_THUMBNAIL"), RenderProfile(72, "rgb", 400)),
+        }
+        pdf_logger.info(f"渲染配置: {self.render_profiles}")
+        
+        # 页面图片上传格式（PNG/JPEG），每页每种格式只编码一次，OCR与VLM共用
+        self.image_format = os.getenv("PAGE_IMAGE_FORMAT", "PNG").upper()
+        if self.image_format not in IMAGE_MIME_TYPES:
+            pdf_logger.warning(f"不支持的页面图片格式 {self.image_format}，使用PNG")
+            self.image_format = "PNG"
+        
+        # 页面图片缓存：按文件哈希、页码、渲染配置寻址，重新处理时无需重新渲染（容量设为0关闭）
+        self.page_cache = DiskCache(
+            os.getenv("PAGE_CACHE_DIR", os.path.join("cache", "pages")),
+            int(float(os.getenv("PAGE_CACHE_MAX_MB", "1024")) * 1024 * 1024),
+            name="page_cache"
+        )
+        
         # 配置检查
         if not self.baidu_api_key or not self.baidu_secret_key:
             pdf_logger.warning("百度OCR API密钥未配置，将无法使用百度OCR服务")
@@ -47,12 +187,36 @@ class PDFProcessor:
             pdf_logger.warning("VLM API密钥未配置，将无法使用VLM服务")
         else:
             pdf_logger.info(f"VLM API密钥已配置，Base URL: {self.base_url}, 模型: {self.vlm_model}")
+    
+    def open_page_stream(self, pdf_path: str, max_pages: int = None, detect_text_layer: bool = True,
+                         detect_blank_pages: bool = True, detect_duplicates: bool = True) -> Optional[PageStream]:
+        """打开PDF页面流，页面在消费时才逐页渲染；带可用文字层的页面和空白页默认跳过渲染"""
+        pdf_logger.info(f"打开PDF页面流: {pdf_path}")
         
-        # 配置Tesseract路径（Windows用户可能需要设置）
-        # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+        try:
+            if not os.path.exists(pdf_path):
+                pdf_logger.error(f"PDF文件不存在: {pdf_path}")
+                return None
+            
+            options = RenderOptions(
+                profiles=self.render_profiles,
+                text_layer_min_chars=self.text_layer_min_chars if detect_text_layer else 0,
+                text_layer_min_ratio=self.text_layer_min_ratio,
+                text_layer_image_min_area=self.text_layer_image_min_area,
+                blank_max_ink=self.blank_page_max_ink if detect_blank_pages else 0.0,
+                page_fingerprint=detect_duplicates and self.duplicate_max_distance >= 0
+            )
+            stream = PageStream(pdf_path, max_pages, self.page_lookahead, self.raster_engine, options, self.page_cache, self.image_format)
+            pdf_logger.info(f"PDF页面流已就绪，共{len(stream)}页，预取{stream.lookahead}页")
+            return stream
+            
+        except Exception as e:
+            pdf_logger.error(f"打开PDF页面流错误: {str(e)}")
+            pdf_logger.error(f"错误详情: {traceback.format_exc()}")
+            return None
     
     def convert_pdf_to_images(self, pdf_path: str, max_pages: int = None) -> List[Image.Image]:
-        """一次性将PDF转换为图片列表，供后续处理使用"""
+        """一次性将PDF转换为图片列表（兼容性方法，处理流程请使用open_page_stream）"""
         return self._pdf_to_images(pdf_path, max_pages)
     
     def _pdf_to_images(self, pdf_path: str, max_pages: int = None) -> List[Image.Image]:
@@ -60,36 +224,11 @@ class PDFProcessor:
         pdf_logger.info(f"开始将PDF转换为图片: {pdf_path}")
         
         try:
-            if not os.path.exists(pdf_path):
-                pdf_logger.error(f"PDF文件不存在: {pdf_path}")
+            stream = self.open_page_stream(pdf_path, max_pages, detect_text_layer=False, detect_blank_pages=False, detect_duplicates=False)
+            if not stream:
                 return []
             
-            doc = fitz.open(pdf_path)
-            images = []
-            
-            # 限制处理的页数
-            total_pages = len(doc)
-            if max_pages:
-                total_pages = min(total_pages, max_pages)
-                pdf_logger.info(f"限制处理页数: {total_pages}/{len(doc)}")
-            else:
-                pdf_logger.info(f"处理全部页数: {total_pages}")
-            
-            for page_num in range(total_pages):
-                pdf_logger.debug(f"处理第{page_num + 1}页")
-                page = doc.load_page(page_num)
-                
-                # 设置缩放比例以提高图像质量
-                mat = fitz.Matrix(2.0, 2.0)  # 2倍缩放
-                pix = page.get_pixmap(matrix=mat)
-                
-                # 转换为PIL Image
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
-                images.append(image)
-                pdf_logger.debug(f"第{page_num + 1}页转换完成，图片尺寸: {image.size}")
-            
-            doc.close()
+            images = [page.image for page in stream]
             pdf_logger.info(f"PDF转图片完成，共转换{len(images)}页")
             return images
             
@@ -98,6 +237,45 @@ class PDFProcessor:
             pdf_logger.error(f"错误详情: {traceback.format_exc()}")
             return []
     
+    async def _iter_pages(self, images: Union[List[Image.Image], PageStream], force_render_pages: int = 0) -> AsyncIterator[RenderedPage]:
+        """统一遍历图片列表或页面流，返回RenderedPage"""
+        if isinstance(images, PageStream):
+            async for page in images.pages(force_render_pages):
+                yield page
+        else:
+            for i, image in enumerate(images):
+                yield RenderedPage(i + 1, image)
+    
+    def get_page_thumbnail(self, pdf_path: str, page_num: int) -> Optional[bytes]:
+        """获取页面缩略图（PNG），优先读取页面图片缓存"""
+        try:
+            if not os.path.exists(pdf_path):
+                pdf_logger.error(f"PDF文件不存在: {pdf_path}")
+                return None
+            
+            doc = fitz.open(pdf_path)
+            try:
+                page_count = len(doc)
+            finally:
+                doc.close()
+            if page_num < 1 or page_num > page_count:
+                return None
+            
+            file_hash = file_sha256(pdf_path) if self.page_cache.enabled else None
+            source = PageSource(pdf_path, self.render_profiles, self.page_cache, file_hash, "PNG")
+            return RenderedPage(page_num, source=source).get_encoded(PROFILE_THUMBNAIL, "PNG")
+            
+        except Exception as e:
+            pdf_logger.error(f"获取第{page_num}页缩略图错误: {str(e)}")
+            pdf_logger.error(f"错误详情: {traceback.format_exc()}")
+            return None
+    
+    async def shutdown(self):
+        """释放后台资源（进程池、HTTP连接等）"""
+        self.raster_engine.shutdown()
+        self.tesseract_pool.shutdown()
+        await self.baidu_ocr.aclose()
+    
     def get_pdf_info(self, pdf_path: str) -> Dict[str, Any]:
         """获取PDF基本信息"""
         try:
@@ -119,67 +297,26 @@ class PDFProcessor:
 
     async def get_baidu_access_token(self) -> str:
         """获取百度API的access_token"""
-        if self.baidu_access_token:
-            pdf_logger.debug("使用缓存的百度access_token")
-            return self.baidu_access_token
-            
-        pdf_logger.info("开始获取百度API access_token")
-        
         try:
-            if not self.baidu_api_key or not self.baidu_secret_key:
-                raise Exception("百度API密钥未配置")
-                
-            url = "https://aip.baidubce.com/oauth/2.0/token"
-            params = {
-                "grant_type": "client_credentials",
-                "client_id": self.baidu_api_key,
-                "client_secret": self.baidu_secret_key
-            }
-            
-            pdf_logger.debug(f"请求百度token URL: {url}")
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, params=params)
-                pdf_logger.debug(f"百度token响应状态码: {response.status_code}")
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    self.baidu_access_token = result.get("access_token")
-                    if self.baidu_access_token:
-                        pdf_logger.info("百度access_token获取成功")
-                        return self.baidu_access_token
-                    else:
-                        raise Exception(f"响应中未找到access_token: {result}")
-                else:
-                    error_text = response.text
-                    raise Exception(f"获取access_token失败: {response.status_code}, {error_text}")
-                    
+            return await self.baidu_ocr.get_access_token()
         except Exception as e:
             pdf_logger.error(f"获取百度access_token错误: {str(e)}")
             pdf_logger.error(f"错误详情: {traceback.format_exc()}")
             raise e
 
-    def process_single_page_ocr_sync(self, image: Image.Image, page_num: int, access_token: str = None) -> Dict[str, Any]:
-        """处理单页OCR识别 - 同步版本，控制QPS"""
+    async def process_single_page_ocr(self, image: Image.Image, page_num: int, access_token: str = None, image_base64: str = None,
+                                      fallback_image_loader: Callable[[], Image.Image] = None) -> Dict[str, Any]:
+        """处理单页OCR识别，通过异步客户端调用百度OCR（令牌桶控制QPS）；fallback_image_loader提供Tesseract回退所用的图片"""
         pdf_logger.debug(f"开始OCR识别第{page_num}页")
+        start_time = time.perf_counter()
         
         try:
-            # QPS控制：确保调用间隔
-            current_time = time.time()
-            time_since_last_call = current_time - self.ocr_last_call_time
-            if time_since_last_call < self.ocr_min_interval:
-                sleep_time = self.ocr_min_interval - time_since_last_call
-                pdf_logger.debug(f"QPS控制：等待{sleep_time:.2f}秒")
-                time.sleep(sleep_time)
-            
-            self.ocr_last_call_time = time.time()
+            if image_base64 is None:
+                image_base64 = encode_image_base64(image, self.image_format)
             
-            if not access_token:
-                # 同步获取token
-                access_token = self._get_baidu_access_token_sync()
-            
-            # 调用百度OCR API（同步版本）
-            ocr_result = self._call_baidu_ocr_api_sync(image, access_token)
+            ocr_response = await self.baidu_ocr.recognize(image_base64, access_token)
+            ocr_result = self.baidu_ocr.extract_text(ocr_response)
+            await self._store_cached_ocr(image_base64, ocr_response)
             
             result = {
                 "page_num": page_num,
@@ -187,7 +324,9 @@ class PDFProcessor:
                 "success": True,
                 "text": ocr_result,
                 "text_length": len(ocr_result),
-                "error": None
+                "error": None,
+                "elapsed": round(time.perf_counter() - start_time, 3),
+                **self._confidence_fields(ocr_response)
             }
             
             pdf_logger.debug(f"第{page_num}页OCR完成，识别文本长度: {len(ocr_result)}")
@@ -196,18 +335,21 @@ class PDFProcessor:
         except Exception as e:
             pdf_logger.error(f"第{page_num}页OCR处理错误: {str(e)}")
             
-            # 回退到Tesseract
+            # 回退到Tesseract（进程池中执行）
             try:
-                text = pytesseract.image_to_string(image, lang='chi_sim+eng')
+                tesseract_image = await asyncio.to_thread(fallback_image_loader) if fallback_image_loader else image
+                text, tesseract_elapsed = await self.tesseract_pool.recognize(tesseract_image)
                 result = {
                     "page_num": page_num,
                     "method": "tesseract_fallback",
                     "success": True,
                     "text": text,
                     "text_length": len(text),
-                    "error": f"百度OCR失败，使用Tesseract: {str(e)}"
+                    "error": f"百度OCR失败，使用Tesseract: {str(e)}",
+                    "elapsed": round(time.perf_counter() - start_time, 3),
+                    "tesseract_elapsed": round(tesseract_elapsed, 3)
                 }
-                pdf_logger.debug(f"第{page_num}页Tesseract OCR完成")
+                pdf_logger.debug(f"第{page_num}页Tesseract OCR完成，识别耗时{tesseract_elapsed:.2f}秒")
                 return result
             except Exception as tesseract_error:
                 result = {
@@ -216,18 +358,69 @@ class PDFProcessor:
                     "success": False,
                     "text": "",
                     "text_length": 0,
-                    "error": f"OCR完全失败: 百度OCR={str(e)}, Tesseract={str(tesseract_error)}"
+                    "error": f"OCR完全失败: 百度OCR={str(e)}, Tesseract={str(tesseract_error)}",
+                    "elapsed": round(time.perf_counter() - start_time, 3)
                 }
                 pdf_logger.error(f"第{page_num}页OCR完全失败")
                 return result
 
-    async def process_single_page_vlm(self, image: Image.Image, page_num: int) -> Dict[str, Any]:
-        """处理单页VLM分析"""
+    def _ocr_cache_key(self, image_base64: str) -> str:
+        """OCR结果缓存键：页面图片哈希 + OCR接口 + 识别参数"""
+        digest = hashlib.sha256(image_base64.encode("ascii")).hexdigest()
+        options = json.dumps(self.baidu_ocr.request_options(), sort_keys=True)
+        return f"ocr:{self.baidu_ocr.endpoint}:{options}:{digest}"
+
+    async def _store_cached_ocr(self, image_base64: str, ocr_response: Dict[str, Any]):
+        """写入OCR结果缓存"""
+        if self.ocr_cache.enabled:
+            cache_data = json.dumps(ocr_response, ensure_ascii=False).encode("utf-8")
+            await asyncio.to_thread(self.ocr_cache.set, self._ocr_cache_key(image_base64), cache_data)
+
+    def _load_cached_ocr(self, page: RenderedPage) -> Optional[Dict[str, Any]]:
+        """读取缓存的OCR结果，命中时直接生成页面记录，不占用百度OCR配额（在后台线程中调用，包括生成上传数据）"""
+        start_time = time.perf_counter()
+        page_num = page.page_num
+        cache_key = self._ocr_cache_key(page.get_payload(PROFILE_OCR, self.image_format))
+        data = self.ocr_cache.get(cache_key)
+        if data is None:
+            return None
+        try:
+            ocr_response = json.loads(data)
+            ocr_result = self.baidu_ocr.extract_text(ocr_response)
+        except (ValueError, KeyError, TypeError) as e:
+            pdf_logger.warning(f"第{page_num}页OCR缓存损坏，重新识别: {str(e)}")
+            self.ocr_cache.delete(cache_key)
+            return None
+        
+        pdf_logger.debug(f"第{page_num}页命中OCR缓存，文本长度: {len(ocr_result)}")
+        return {
+            "page_num": page_num,
+            "method": "baidu_ocr",
+            "success": True,
+            "text": ocr_result,
+            "text_length": len(ocr_result),
+            "error": None,
+            "elapsed": round(time.perf_counter() - start_time, 3),
+            "cached": True,
+            **self._confidence_fields(ocr_response)
+        }
+
+    def _confidence_fields(self, ocr_response: Dict[str, Any]) -> Dict[str, Any]:
+        """OCR置信度字段：页面置信度及每行置信度"""
+        return {
+            "confidence": self.baidu_ocr.page_confidence(ocr_response),
+            "line_confidence": self.baidu_ocr.extract_line_confidence(ocr_response)
+        }
+
+    async def process_single_page_vlm(self, image: Image.Image, page_num: int, image_base64: str = None,
+                                      on_progress: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+        """处理单页VLM分析，on_progress在流式输出过程中接收该页的部分结果"""
         pdf_logger.debug(f"开始VLM分析第{page_num}页")
         
         try:
             # 调用VLM API
-            vlm_result = await self._call_vlm_api(image)
+            on_text = (lambda text: on_progress(self._partial_vlm_record(page_num, text))) if on_progress else None
+            vlm_result = await self._call_vlm_api(image, image_base64, on_text)
             
             result = {
                 "page_num": page_num,
@@ -241,6 +434,18 @@ class PDFProcessor:
             pdf_logger.debug(f"第{page_num}页VLM分析完成，结果长度: {len(vlm_result)}")
             return result
             
+        except VLMTimeoutError as e:
+            pdf_logger.warning(f"第{page_num}页VLM输出超时，保留部分结果，长度: {len(e.partial_text)}")
+            return {
+                "page_num": page_num,
+                "method": "vlm",
+                "success": True,
+                "text": e.partial_text,
+                "text_length": len(e.partial_text),
+                "error": str(e),
+                "truncated": True
+            }
+            
         except Exception as e:
             pdf_logger.error(f"第{page_num}页VLM处理错误: {str(e)}")
             result = {
@@ -253,103 +458,555 @@ class PDFProcessor:
             }
             return result
 
-    async def process_images_batch(self, images: List[Image.Image], max_vlm_pages: int = 0) -> Dict[str, Any]:
-        """批量处理图片列表，避免重复转换PDF"""
-        pdf_logger.info(f"开始批量处理{len(images)}页图片")
+    async def process_images_batch(self, images: Union[List[Image.Image], PageStream], max_vlm_pages: int = 0,
+                                   vlm_selection: str = None, on_vlm_progress: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+        """批量处理图片列表或页面流，逐页消费，只保留VLM所需的页面
+
+        max_vlm_pages 为VLM页数预算；vlm_selection 为confidence时把预算分配给OCR识别失败和置信度低的页面，
+        为first时分析前N页，默认使用VLM_PAGE_SELECTION配置。OCR与VLM作为两条流水线并发运行，各自受限流控制，最后汇总。
+        on_vlm_progress 在VLM流式输出过程中接收各页的部分结果（partial为True）。
+        """
+        total_pages = len(images)
+        select_by_confidence = (vlm_selection or self.vlm_page_selection) == "confidence"
+        pdf_logger.info(f"开始批量处理{total_pages}页图片")
         
+        ocr_items = []
+        vlm_pipeline = VLMPipeline(lambda pages: self._vlm_batch_records(pages, on_vlm_progress),
+                                   self.vlm_batch_pages, max_vlm_pages, self.vlm_confidence_threshold)
         try:
-            # 获取百度OCR token（同步）
-            access_token = self._get_baidu_access_token_sync()
+            # 百度OCR token在首个需要OCR的页面时获取（获取失败则整批失败），之后由客户端负责续期
+            token_checked = False
             
-            # 串行处理OCR（控制QPS）
-            pdf_logger.info("开始串行OCR处理（QPS控制）")
-            ocr_results = []
-            for i, image in enumerate(images):
-                try:
-                    result = self.process_single_page_ocr_sync(image, i + 1, access_token)
-                    ocr_results.append(result)
-                except Exception as e:
-                    ocr_results.append(e)
-                    pdf_logger.error(f"第{i+1}页OCR处理异常: {str(e)}")
+            # 并发处理OCR（令牌桶控制QPS，信号量限制在途请求数），带可用文字层的页面直接使用内嵌文本，页面用完即释放
+            pdf_logger.info(f"开始OCR处理（QPS控制，并发{self.ocr_concurrency}个请求，每次最多{self.ocr_batch_pages}页）")
+            semaphore = asyncio.Semaphore(self.ocr_concurrency)
+            batch = []
+            # 按置信度选择时的候选页面，OCR完成后释放图片并根据结果决定是否提交VLM（选中后重新读取图片）
+            vlm_candidates = {}
             
-            # 处理OCR异常结果
-            ocr_pages = []
-            for i, result in enumerate(ocr_results):
-                if isinstance(result, Exception):
-                    ocr_pages.append({
-                        "page_num": i + 1,
-                        "method": "failed",
-                        "success": False,
+            def on_ocr_done(records: List[Dict[str, Any]]):
+                for record in records:
+                    if record["page_num"] in duplicate_candidates:
+                        duplicate_candidates[record["page_num"]][0].release()
+                    candidate = vlm_candidates.pop(record["page_num"], None)
+                    if candidate is not None:
+                        candidate.release()
+                        vlm_pipeline.offer(candidate, record)
+            
+            # 带嵌入图片页面的文字层文本，OCR完成后与识别结果合并
+            embedded_texts = {}
+            # 已出现页面的索引，重复页的 (页码, 原页码)，以及指纹相近、等待识别文本确认的页面 {页码: (页面, 候选原页码)}
+            duplicate_index = DuplicatePageIndex(self.duplicate_max_distance, self.duplicate_max_candidates)
+            duplicates = []
+            duplicate_candidates = {}
+            async for page in self._iter_pages(images, 0 if select_by_confidence else max_vlm_pages):
+                page_num = page.page_num
+                if page.blank:
+                    pdf_logger.debug(f"第{page_num}页为空白页，跳过OCR和VLM")
+                    ocr_items.append({
+                        "page_num": page_num,
+                        "method": "blank",
+                        "success": True,
                         "text": "",
                         "text_length": 0,
-                        "error": str(result)
+                        "error": None,
+                        "skipped": True
                     })
-                else:
-                    ocr_pages.append(result)
-            
-            # 并行处理VLM（限制页数）
-            vlm_pages = []
-            if max_vlm_pages > 0:
-                vlm_images = images[:max_vlm_pages]
-                pdf_logger.info(f"开始并行VLM处理（前{len(vlm_images)}页）")
+                    continue
                 
-                vlm_tasks = []
-                for i, image in enumerate(vlm_images):
-                    task = self.process_single_page_vlm(image, i + 1)
-                    vlm_tasks.append(task)
+                # 指纹缓存读写在后台线程进行，不阻塞事件循环
+                duplicate_of, candidates = await asyncio.to_thread(self._find_duplicate_page, page, duplicate_index)
+                if duplicate_of is not None:
+                    pdf_logger.info(f"第{page_num}页与第{duplicate_of}页文字层相同，复用识别结果")
+                    ocr_items.append(self._duplicate_record(page_num, duplicate_of))
+                    duplicates.append((page_num, duplicate_of))
+                    continue
                 
-                vlm_results = await asyncio.gather(*vlm_tasks, return_exceptions=True)
+                if page.embedded_text is not None:
+                    embedded_texts[page_num] = page.embedded_text
                 
-                # 处理VLM异常结果
-                for i, result in enumerate(vlm_results):
-                    if isinstance(result, Exception):
-                        vlm_pages.append({
-                            "page_num": i + 1,
-                            "method": "vlm",
-                            "success": False,
-                            "text": "",
-                            "text_length": 0,
-                            "error": str(result)
-                        })
-                    else:
-                        vlm_pages.append(result)
+                if candidates:
+                    # 指纹相近的页面照常OCR，识别文本相同才确认重复，确认前不提交VLM
+                    pdf_logger.debug(f"第{page_num}页与第{candidates}页指纹相近，OCR后比对文本")
+                    duplicate_candidates[page_num] = (page, candidates)
+                elif not select_by_confidence and page_num <= max_vlm_pages:
+                    vlm_pipeline.submit(page)
+                elif select_by_confidence and max_vlm_pages > 0 and page.text_layer is None:
+                    # 文字层文本准确，不需要VLM复核
+                    vlm_candidates[page_num] = page
+                
+                if page.text_layer is not None:
+                    pdf_logger.debug(f"第{page_num}页使用文字层，跳过OCR，文本长度: {len(page.text_layer)}")
+                    ocr_items.append({
+                        "page_num": page_num,
+                        "method": "text_layer",
+                        "success": True,
+                        "text": page.text_layer,
+                        "text_length": len(page.text_layer),
+                        "error": None
+                    })
+                    continue
+                
+                # 先查OCR结果缓存，重复页面不再调用百度OCR（图片编码和缓存读写在后台线程进行）
+                if self.ocr_cache.enabled:
+                    cached = await asyncio.to_thread(self._load_cached_ocr, page)
+                    if cached is not None:
+                        ocr_items.append(cached)
+                        on_ocr_done([cached])
+                        continue
+                
+                if not token_checked:
+                    await self.baidu_ocr.get_access_token()
+                    token_checked = True
+                
+                # 拼接后超出尺寸限制时先提交已积累的页面（计算拼接高度所需的图片在后台线程读取或渲染）
+                if self.ocr_batch_pages > 1:
+                    await asyncio.to_thread(self._load_ocr_images, [page])
+                if batch and self._stitched_height(batch + [page]) > MAX_IMAGE_SIDE:
+                    await self._submit_ocr_batch(batch, semaphore, ocr_items, on_ocr_done)
+                    batch = []
+                batch.append(page)
+                if len(batch) >= self.ocr_batch_pages:
+                    await self._submit_ocr_batch(batch, semaphore, ocr_items, on_ocr_done)
+                    batch = []
+            
+            if batch:
+                await self._submit_ocr_batch(batch, semaphore, ocr_items, on_ocr_done)
+            
+            # 按页码顺序汇总OCR结果
+            ocr_pages = []
+            for item in ocr_items:
+                if isinstance(item, asyncio.Task):
+                    ocr_pages.extend(await item)
+                else:
+                    ocr_pages.append(item)
+            ocr_pages.sort(key=lambda p: p["page_num"])
+            self._merge_text_layers(ocr_pages, embedded_texts)
+            confirmed = self._confirm_duplicates(ocr_pages, duplicate_candidates)
+            duplicates.extend(confirmed.items())
+            self._fill_duplicates(ocr_pages)
+            vlm_candidates.clear()
+            
+            # 未确认重复的候选页按普通页面参与VLM选择
+            for p in ocr_pages:
+                candidate = duplicate_candidates.get(p["page_num"])
+                if candidate is None or p["page_num"] in confirmed:
+                    continue
+                if not select_by_confidence and p["page_num"] <= max_vlm_pages:
+                    vlm_pipeline.submit(candidate[0])
+                elif select_by_confidence and max_vlm_pages > 0:
+                    vlm_pipeline.offer(candidate[0], p)
+            duplicate_candidates.clear()
+            
+            # 等待VLM流水线完成（OCR期间已在并发处理），原页面参与VLM的重复页复用其结果
+            vlm_pages = await vlm_pipeline.finish()
+            pdf_logger.info(f"VLM处理完成: 第{sorted(vlm_pipeline.selected)}页（{'按置信度选择' if select_by_confidence else '前N页'}，每次最多{self.vlm_batch_pages}页）")
+            vlm_page_nums = set(vlm_pipeline.selected)
+            vlm_duplicates = [self._duplicate_record(page_num, duplicate_of) for page_num, duplicate_of in duplicates if duplicate_of in vlm_page_nums]
+            if vlm_duplicates:
+                vlm_pages.extend(vlm_duplicates)
+                vlm_pages.sort(key=lambda p: p["page_num"])
+                self._fill_duplicates(vlm_pages)
             
             # 统计结果
             ocr_successful = [p for p in ocr_pages if p["success"]]
+            text_layer_pages = [p for p in ocr_pages if p["method"] == "text_layer"]
+            cached_pages = [p for p in ocr_pages if p.get("cached")]
+            blank_pages = [p for p in ocr_pages if p["method"] == "blank"]
+            duplicate_pages = [p for p in ocr_pages if p["method"] == "duplicate"]
             vlm_successful = [p for p in vlm_pages if p["success"]]
             
             # 生成摘要
-            ocr_summary = "\n".join([f"=== 第{p['page_num']}页 ===\n{p['text']}\n" for p in ocr_successful])
-            vlm_summary = "\n".join([f"=== VLM第{p['page_num']}页分析 ===\n{p['text']}\n" for p in vlm_successful])
+            ocr_summary = self._build_summary(ocr_successful, "=== 第{page_num}页 ===")
+            vlm_summary = self._build_summary(vlm_successful, "=== VLM第{page_num}页分析 ===")
             
             result = {
                 "ocr_result": {
                     "success": len(ocr_successful) > 0,
                     "pages": ocr_pages,
-                    "total_pages": len(images),
+                    "total_pages": len(ocr_pages),
                     "successful_pages": len(ocr_successful),
+                    "text_layer_pages": len(text_layer_pages),
+                    "cached_pages": len(cached_pages),
+                    "blank_pages": len(blank_pages),
+                    "duplicate_pages": len(duplicate_pages),
                     "summary": ocr_summary,
                     "total_text_length": len(ocr_summary)
                 },
                 "vlm_result": {
                     "success": len(vlm_successful) > 0,
                     "pages": vlm_pages,
-                    "total_pages": len(vlm_images) if max_vlm_pages > 0 else 0,
+                    "total_pages": len(vlm_pages),
                     "successful_pages": len(vlm_successful),
+                    "truncated_pages": len([p for p in vlm_pages if p.get("truncated")]),
+                    "cached_pages": len([p for p in vlm_pages if p.get("cached")]),
                     "summary": vlm_summary,
                     "total_text_length": len(vlm_summary)
                 }
             }
             
-            pdf_logger.info(f"批量处理完成: OCR成功{len(ocr_successful)}/{len(images)}页, VLM成功{len(vlm_successful)}/{len(vlm_images) if max_vlm_pages > 0 else 0}页")
+            pdf_logger.info(f"批量处理完成: OCR成功{len(ocr_successful)}/{len(ocr_pages)}页（文字层{len(text_layer_pages)}页，缓存命中{len(cached_pages)}页，空白{len(blank_pages)}页，重复{len(duplicate_pages)}页）, VLM成功{len(vlm_successful)}/{len(vlm_pages)}页")
             return result
             
         except Exception as e:
             pdf_logger.error(f"批量处理失败: {str(e)}")
+            for item in ocr_items:
+                if isinstance(item, asyncio.Task):
+                    item.cancel()
+            vlm_pipeline.cancel()
             raise e
 
-    async def extract_text_combined_with_images(self, pdf_info: Dict[str, Any], images: List[Image.Image], vlm_pages: int = 3) -> Dict[str, Any]:
-        """使用已转换的图片进行组合文本提取 - 避免重复PDF读取"""
+    def _find_duplicate_page(self, page: RenderedPage, duplicate_index: DuplicatePageIndex) -> Tuple[Optional[int], List[int]]:
+        """查找与当前页重复的已出现页面，返回 (文字层相同的页码, 指纹相近的候选页码)"""
+        if self.duplicate_max_distance < 0:
+            return None, []
+        if page.text_layer is not None:
+            return duplicate_index.check_text(page.page_num, page.text_layer), []
+        return None, duplicate_index.candidates(page.page_num, page.load_fingerprint())
+
+    def _confirm_duplicates(self, pages: List[Dict[str, Any]], duplicate_candidates: Dict[int, tuple]) -> Dict[int, int]:
+        """按页码顺序确认候选重复页：识别文本与某个候选页相同才标记为重复，返回 {页码: 原页码}"""
+        by_page = {p["page_num"]: p for p in pages}
+        confirmed = {}
+        for p in pages:
+            candidate = duplicate_candidates.get(p["page_num"])
+            if candidate is None or not p["success"]:
+                continue
+            for seen_page_num in candidate[1]:
+                original = by_page.get(seen_page_num)
+                if original is None or not original["success"] or not same_text(p["text"], original["text"]):
+                    continue
+                # 候选页本身是重复页时指向其原页面
+                duplicate_of = original.get("duplicate_of") or seen_page_num
+                pdf_logger.info(f"第{p['page_num']}页与第{duplicate_of}页内容相同，复用识别结果")
+                p.update(method="duplicate", skipped=True, duplicate_of=duplicate_of)
+                confirmed[p["page_num"]] = duplicate_of
+                break
+        return confirmed
+
+    def _merge_text_layers(self, pages: List[Dict[str, Any]], embedded_texts: Dict[int, str]):
+        """带嵌入图片页面的OCR结果与文字层合并：保留文字层全文，补充OCR识别出的其他行（图片中的文字）"""
+        for p in pages:
+            text_layer = embedded_texts.get(p["page_num"])
+            if text_layer is None:
+                continue
+            known_lines = {line.strip() for line in text_layer.splitlines() if line.strip()}
+            extra_lines = [line for line in p["text"].splitlines() if line.strip() and line.strip() not in known_lines]
+            p["text"] = "\n".join([text_layer] + extra_lines)
+            p["text_length"] = len(p["text"])
+            p["text_layer"] = True
+            if not p["success"]:
+                # OCR失败时至少保留文字层文本
+                p["success"] = True
+
+    def _duplicate_record(self, page_num: int, duplicate_of: int) -> Dict[str, Any]:
+        """重复页的占位记录，结果在原页面处理完成后填充"""
+        return {
+            "page_num": page_num,
+            "method": "duplicate",
+            "success": False,
+            "text": "",
+            "text_length": 0,
+            "error": None,
+            "skipped": True,
+            "duplicate_of": duplicate_of
+        }
+
+    def _fill_duplicates(self, pages: List[Dict[str, Any]]):
+        """用原页面的结果填充重复页记录"""
+        by_page = {p["page_num"]: p for p in pages}
+        for p in pages:
+            original = by_page.get(p.get("duplicate_of"))
+            if p["method"] == "duplicate" and original is not None:
+                p.update(success=original["success"], text=original["text"],
+                         text_length=original["text_length"], error=original["error"])
+
+    def _build_summary(self, pages: List[Dict[str, Any]], heading: str) -> str:
+        """生成摘要：跳过空白页，重复页只注明与哪一页相同，不重复全文"""
+        sections = []
+        for p in pages:
+            title = heading.format(page_num=p["page_num"])
+            if p.get("duplicate_of"):
+                sections.append(f"{title}\n（与第{p['duplicate_of']}页内容相同）\n")
+            elif not p.get("skipped"):
+                sections.append(f"{title}\n{p['text']}\n")
+        return "\n".join(sections)
+
+    def _stitched_height(self, pages: List[RenderedPage]) -> int:
+        """多页纵向拼接后的高度"""
+        return sum(page.image.height for page in pages) + STITCH_GAP * (len(pages) - 1)
+
+    async def _submit_ocr_batch(self, pages: List[RenderedPage], semaphore: asyncio.Semaphore, ocr_items: List[Any],
+                                on_done: Callable[[List[Dict[str, Any]]], None] = None):
+        """占用一个并发名额后提交OCR任务，on_done在识别完成后接收各页结果
+
+        on_done在任务内调用而不是作为完成回调：汇总时等待已完成的任务会立即返回，此时完成回调可能尚未执行。
+        """
+        await semaphore.acquire()
+        
+        async def run() -> List[Dict[str, Any]]:
+            records = await self._ocr_batch_task(pages, semaphore)
+            if on_done is not None:
+                on_done(records)
+            return records
+        
+        ocr_items.append(asyncio.create_task(run()))
+
+    async def _ocr_batch_task(self, pages: List[RenderedPage], semaphore: asyncio.Semaphore) -> List[Dict[str, Any]]:
+        """OCR任务：多页合并为一次请求，合并识别失败时逐页识别；完成后释放并发名额"""
+        try:
+            if len(pages) > 1:
+                start_time = time.perf_counter()
+                try:
+                    images = await asyncio.to_thread(self._load_ocr_images, pages)
+                    ocr_responses = await self.baidu_ocr.recognize_pages(images, self.image_format)
+                except Exception as e:
+                    pdf_logger.warning(f"第{pages[0].page_num}-{pages[-1].page_num}页合并OCR失败，改为逐页识别: {str(e)}")
+                else:
+                    elapsed = round(time.perf_counter() - start_time, 3)
+                    results = []
+                    for page, ocr_response in zip(pages, ocr_responses):
+                        if self.ocr_cache.enabled:
+                            image_base64 = await asyncio.to_thread(page.get_payload, PROFILE_OCR, self.image_format)
+                            await self._store_cached_ocr(image_base64, ocr_response)
+                        text = self.baidu_ocr.extract_text(ocr_response)
+                        results.append({
+                            "page_num": page.page_num,
+                            "method": "baidu_ocr",
+                            "success": True,
+                            "text": text,
+                            "text_length": len(text),
+                            "error": None,
+                            "elapsed": elapsed,
+                            "batch_pages": len(pages),
+                            **self._confidence_fields(ocr_response)
+                        })
+                    pdf_logger.debug(f"第{pages[0].page_num}-{pages[-1].page_num}页合并OCR完成")
+                    return results
+            
+            return list(await asyncio.gather(*[self._ocr_page(page) for page in pages]))
+        finally:
+            semaphore.release()
+
+    async def _ocr_page(self, page: RenderedPage) -> Dict[str, Any]:
+        """单页OCR，异常时返回失败记录"""
+        try:
+            # 读取页面缓存、编码图片在后台线程进行，不阻塞事件循环
+            image_base64 = await asyncio.to_thread(page.get_payload, PROFILE_OCR, self.image_format)
+            return await self.process_single_page_ocr(
+                None, page.page_num, None, image_base64,
+                lambda: page.get_image(PROFILE_TESSERACT)
+            )
+        except Exception as e:
+            pdf_logger.error(f"第{page.page_num}页OCR处理异常: {str(e)}")
+            return {
+                "page_num": page.page_num,
+                "method": "failed",
+                "success": False,
+                "text": "",
+                "text_length": 0,
+                "error": str(e)
+            }
+
+    async def _vlm_batch_records(self, pages: List[RenderedPage], on_progress: Callable[[Dict[str, Any]], None] = None) -> List[Dict[str, Any]]:
+        """执行VLM任务，异常时为每页生成失败记录"""
+        try:
+            records = await self._vlm_batch_task(pages, on_progress)
+            if on_progress:
+                for record in records:
+                    on_progress(record)
+            return records
+        except Exception as e:
+            pdf_logger.error(f"第{[page.page_num for page in pages]}页VLM处理异常: {str(e)}")
+            return [{
+                "page_num": page.page_num,
+                "method": "vlm",
+                "success": False,
+                "text": "",
+                "text_length": 0,
+                "error": str(e)
+            } for page in pages]
+
+    async def _vlm_batch_task(self, pages: List[RenderedPage], on_progress: Callable[[Dict[str, Any]], None] = None) -> List[Dict[str, Any]]:
+        """VLM任务：多页合并为一次请求，按分页标记拆回各页；合并请求失败或缺少某页结果时逐页分析"""
+        # 未预先渲染的VLM图片在后台线程读取缓存或渲染，不阻塞事件循环
+        await asyncio.to_thread(self._load_vlm_payloads, pages)
+        results = []
+        if self.vlm_cache.enabled:
+            results, pages = await asyncio.to_thread(self._load_cached_vlm_pages, pages)
+            if not pages:
+                return results
+        cached_count = len(results)
+        missing = pages
+        if len(pages) > 1:
+            start_time = time.perf_counter()
+            page_nums = {page.page_num for page in pages}
+            on_text = None
+            if on_progress:
+                def on_text(text: str):
+                    for page_num, page_text in self._split_vlm_pages(text, page_nums).items():
+                        on_progress(self._partial_vlm_record(page_num, page_text))
+            
+            truncated_page = None
+            try:
+                texts = self._split_vlm_pages(await self._call_vlm_api_batch(pages, on_text), page_nums)
+            except VLMTimeoutError as e:
+                # 超时前已完整输出的页面直接使用，最后一页内容可能不完整
+                texts = self._split_vlm_pages(e.partial_text, page_nums)
+                truncated_page = list(texts)[-1] if texts else None
+                pdf_logger.warning(f"第{pages[0].page_num}-{pages[-1].page_num}页合并VLM输出超时，保留{len(texts)}页部分结果")
+            except Exception as e:
+                pdf_logger.warning(f"第{pages[0].page_num}-{pages[-1].page_num}页合并VLM失败，改为逐页分析: {str(e)}")
+                texts = {}
+            elapsed = round(time.perf_counter() - start_time, 3)
+            
+            missing = []
+            for page in pages:
+                text = texts.get(page.page_num)
+                if text is None:
+                    missing.append(page)
+                    continue
+                record = {
+                    "page_num": page.page_num,
+                    "method": "vlm",
+                    "success": True,
+                    "text": text,
+                    "text_length": len(text),
+                    "error": None,
+                    "elapsed": elapsed,
+                    "batch_pages": len(pages)
+                }
+                if page.page_num == truncated_page:
+                    record.update(error="VLM输出超时，已保留部分结果", truncated=True)
+                results.append(record)
+            if texts and missing:
+                pdf_logger.warning(f"合并VLM结果缺少第{[page.page_num for page in missing]}页，改为逐页分析")
+        
+        # 编码数据已由_load_vlm_payloads预先读取，不再在事件循环中读取或渲染图片
+        results.extend(await asyncio.gather(*[
+            self.process_single_page_vlm(None, page.page_num, page.get_payload(PROFILE_VLM, self.image_format), on_progress)
+            for page in missing
+        ]))
+        
+        # 只缓存完整且非空的结果，截断、失败和空结果的页面下次重新分析
+        if self.vlm_cache.enabled:
+            payloads = {page.page_num: page.get_payload(PROFILE_VLM, self.image_format) for page in pages}
+            fresh = [(payloads[r["page_num"]], r["text"]) for r in results[cached_count:]
+                     if r["success"] and not r.get("truncated") and r["text"].strip()]
+            if fresh:
+                await asyncio.to_thread(self._store_cached_vlm, fresh)
+        results.sort(key=lambda p: p["page_num"])
+        return results
+
+    def _vlm_generations_path(self) -> str:
+        return os.path.join(self.vlm_cache.directory, "generations.json")
+
+    def _vlm_cache_generation(self, model: str) -> int:
+        """模型的VLM缓存代数，使缓存失效时递增"""
+        try:
+            with open(self._vlm_generations_path(), "r", encoding="utf-8") as f:
+                return int(json.load(f).get(model, 0))
+        except (OSError, ValueError):
+            return 0
+
+    def invalidate_vlm_cache(self, model: str = None) -> int:
+        """使指定模型（默认当前VLM模型）的VLM缓存全部失效：递增缓存代数，旧条目不再命中，随LRU淘汰，返回新的代数"""
+        model = model or self.vlm_model
+        path = self._vlm_generations_path()
+        with self._vlm_generation_lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    generations = json.load(f)
+            except (OSError, ValueError):
+                generations = {}
+            generations[model] = int(generations.get(model, 0)) + 1
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(generations, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        pdf_logger.info(f"VLM缓存已失效: 模型 {model}, 代数 {generations[model]}")
+        return generations[model]
+
+    def _vlm_cache_key(self, image_base64: str, generation: int) -> str:
+        """VLM结果缓存键：模型 + 缓存代数 + 提示词哈希 + 页面图片哈希"""
+        digest = hashlib.sha256(image_base64.encode("ascii")).hexdigest()
+        return f"vlm:{self.vlm_model}:{generation}:{self.vlm_prompt_hash}:{digest}"
+
+    def _store_cached_vlm(self, entries: List[tuple]):
+        """写入VLM结果缓存，entries为 (页面base64, 文本) 列表，空文本不缓存"""
+        generation = self._vlm_cache_generation(self.vlm_model)
+        for image_base64, text in entries:
+            if not text.strip():
+                continue
+            data = json.dumps({"text": text, "created_at": time.time()}, ensure_ascii=False).encode("utf-8")
+            self.vlm_cache.set(self._vlm_cache_key(image_base64, generation), data)
+
+    def _load_cached_vlm_pages(self, pages: List[RenderedPage]) -> tuple:
+        """读取缓存的VLM结果，返回 (命中页面的记录, 未命中的页面)，过期、损坏或为空的条目被删除"""
+        generation = self._vlm_cache_generation(self.vlm_model)
+        records, remaining = [], []
+        for page in pages:
+            start_time = time.perf_counter()
+            cache_key = self._vlm_cache_key(page.get_payload(PROFILE_VLM, self.image_format), generation)
+            data = self.vlm_cache.get(cache_key)
+            entry = None
+            if data is not None:
+                try:
+                    entry = json.loads(data)
+                    text = entry["text"]
+                except (ValueError, KeyError, TypeError) as e:
+                    pdf_logger.warning(f"第{page.page_num}页VLM缓存损坏，重新分析: {str(e)}")
+                    entry = None
+                if entry is not None and not str(text).strip():
+                    # 旧版本可能缓存了空结果
+                    pdf_logger.debug(f"第{page.page_num}页VLM缓存为空结果，重新分析")
+                    entry = None
+                if entry is not None and self.vlm_cache_ttl > 0 and time.time() - entry.get("created_at", 0) > self.vlm_cache_ttl:
+                    pdf_logger.debug(f"第{page.page_num}页VLM缓存已过期")
+                    entry = None
+                if entry is None:
+                    self.vlm_cache.delete(cache_key)
+            if entry is None:
+                remaining.append(page)
+                continue
+            
+            pdf_logger.debug(f"第{page.page_num}页命中VLM缓存，文本长度: {len(text)}")
+            records.append({
+                "page_num": page.page_num,
+                "method": "vlm",
+                "success": True,
+                "text": text,
+                "text_length": len(text),
+                "error": None,
+                "elapsed": round(time.perf_counter() - start_time, 3),
+                "cached": True
+            })
+        return records, remaining
+
+    def _partial_vlm_record(self, page_num: int, text: str) -> Dict[str, Any]:
+        """流式输出过程中的VLM部分结果"""
+        return {
+            "page_num": page_num,
+            "method": "vlm",
+            "success": False,
+            "text": text,
+            "text_length": len(text),
+            "error": None,
+            "partial": True
+        }
+
+    def _load_ocr_images(self, pages: List[RenderedPage]) -> List[Image.Image]:
+        """读取或渲染OCR图片（多页合并识别时拼接使用），在后台线程中调用"""
+        return [page.image for page in pages]
+
+    def _load_vlm_payloads(self, pages: List[RenderedPage]):
+        for page in pages:
+            page.get_payload(PROFILE_VLM, self.image_format)
+
+    async def extract_text_combined_with_images(self, pdf_info: Dict[str, Any], images: Union[List[Image.Image], PageStream], vlm_pages: int = 3,
+                                                on_vlm_progress: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+        """使用图片列表或页面流进行组合文本提取 - 避免重复PDF读取，on_vlm_progress接收VLM逐页的部分及完成结果"""
         pdf_logger.info(f"开始组合文本提取，共{len(images)}页图片")
         
         try:
@@ -362,7 +1019,7 @@ class PDFProcessor:
                 }
             
             # 使用批量处理方法
-            batch_result = await self.process_images_batch(images, vlm_pages)
+            batch_result = await self.process_images_batch(images, vlm_pages, on_vlm_progress=on_vlm_progress)
             
             result = {
                 "pdf_info": pdf_info,
@@ -400,12 +1057,11 @@ class PDFProcessor:
             # 获取PDF基本信息
             pdf_info = self.get_pdf_info(pdf_path)
             
-            # 一次性转换PDF为图片
-            pdf_logger.info("转换PDF为图片")
-            images = self.convert_pdf_to_images(pdf_path, max_pages)
+            # 打开页面流，逐页渲染
+            pages = self.open_page_stream(pdf_path, max_pages) or []
             
             # 使用新的方法处理
-            return await self.extract_text_combined_with_images(pdf_info, images, vlm_pages)
+            return await self.extract_text_combined_with_images(pdf_info, pages, vlm_pages)
             
         except Exception as e:
             pdf_logger.error(f"组合文本提取错误: {str(e)}")
@@ -421,8 +1077,8 @@ class PDFProcessor:
         pdf_logger.info(f"开始OCR文本提取: {pdf_path}")
         
         try:
-            images = self.convert_pdf_to_images(pdf_path, max_pages)
-            if not images:
+            pages = self.open_page_stream(pdf_path, max_pages)
+            if not pages:
                 return {
                     "success": False,
                     "error": "PDF转图片失败，无法进行OCR识别",
@@ -431,7 +1087,7 @@ class PDFProcessor:
                     "summary": ""
                 }
             
-            batch_result = await self.process_images_batch(images, 0)  # 只处理OCR
+            batch_result = await self.process_images_batch(pages, 0)  # 只处理OCR
             return batch_result["ocr_result"]
             
         except Exception as e:
@@ -449,8 +1105,8 @@ class PDFProcessor:
         pdf_logger.info(f"开始VLM文本分析: {pdf_path}")
         
         try:
-            images = self.convert_pdf_to_images(pdf_path, max_pages)
-            if not images:
+            pages = self.open_page_stream(pdf_path, max_pages)
+            if not pages:
                 return {
                     "success": False,
                     "error": "PDF转图片失败，无法进行VLM分析",
@@ -459,7 +1115,7 @@ class PDFProcessor:
                     "summary": ""
                 }
             
-            batch_result = await self.process_images_batch(images, max_pages)
+            batch_result = await self.process_images_batch(pages, max_pages, vlm_selection="first")
             return batch_result["vlm_result"]
             
         except Exception as e:
@@ -474,152 +1130,62 @@ class PDFProcessor:
 
 
 
-    def _get_baidu_access_token_sync(self) -> str:
-        """同步获取百度API的access_token"""
-        if self.baidu_access_token:
-            pdf_logger.debug("使用缓存的百度access_token")
-            return self.baidu_access_token
-            
-        pdf_logger.info("开始获取百度API access_token")
-        
+    def _parse_retry_after(self, value: Optional[str]) -> Optional[float]:
+        """解析Retry-After响应头（秒数），不超过最大退避时间"""
         try:
-            if not self.baidu_api_key or not self.baidu_secret_key:
-                raise Exception("百度API密钥未配置")
-                
-            url = "https://aip.baidubce.com/oauth/2.0/token"
-            params = {
-                "grant_type": "client_credentials",
-                "client_id": self.baidu_api_key,
-                "client_secret": self.baidu_secret_key
-            }
-            
-            pdf_logger.debug(f"请求百度token URL: {url}")
-            
-            response = requests.post(url, params=params, timeout=30)
-            pdf_logger.debug(f"百度token响应状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                self.baidu_access_token = result.get("access_token")
-                if self.baidu_access_token:
-                    pdf_logger.info("百度access_token获取成功")
-                    return self.baidu_access_token
-                else:
-                    raise Exception(f"响应中未找到access_token: {result}")
-            else:
-                error_text = response.text
-                raise Exception(f"获取access_token失败: {response.status_code}, {error_text}")
-                
-        except Exception as e:
-            pdf_logger.error(f"获取百度access_token错误: {str(e)}")
-            pdf_logger.error(f"错误详情: {traceback.format_exc()}")
-            raise e
+            return min(self.vlm_backoff_max, max(0.0, float(value))) if value else None
+        except ValueError:
+            return None
 
-    def _call_baidu_ocr_api_sync(self, image: Image.Image, access_token: str) -> str:
-        """同步调用百度OCR API"""
-        try:
-            # 将图像转换为base64
-            buffer = io.BytesIO()
-            image.save(buffer, format='PNG')
-            image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/handwriting?access_token={access_token}"
-            
-            headers = {
-                'Content-Type': 'application/x-www-form-urlencoded'
-            }
-            
-            data = {
-                'image': image_base64,
-                'detect_direction': 'true',
-                'paragraph': 'true',
-                'probability': 'true'
+    def _vlm_image_part(self, image_base64: str) -> Dict[str, Any]:
+        """VLM请求中的图片内容"""
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{IMAGE_MIME_TYPES[self.image_format]};base64,{image_base64}"
             }
-            
-            response = requests.post(url, headers=headers, data=data, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                
-                # 解析OCR结果
-                if 'words_result' in result:
-                    words = []
-                    for item in result['words_result']:
-                        words.append(item['words'])
-                    return '\n'.join(words)
-                else:
-                    error_msg = result.get('error_msg', '未知错误')
-                    error_code = result.get('error_code', '未知错误码')
-                    pdf_logger.error(f"OCR识别失败: 错误码={error_code}, 错误信息={error_msg}")
-                    raise Exception(f"OCR识别失败: 错误码={error_code}, 错误信息={error_msg}")
-            else:
-                error_text = response.text
-                pdf_logger.error(f"百度OCR API调用失败: 状态码={response.status_code}, 响应={error_text}")
-                raise Exception(f"百度OCR API调用失败: {response.status_code}, {error_text}")
-                
-        except Exception as e:
-            pdf_logger.error(f"百度OCR API调用异常: {str(e)}")
-            raise e
+        }
 
-    async def _call_baidu_ocr_api(self, image: Image.Image, access_token: str) -> str:
-        """调用百度OCR API"""
-        try:
-            # 将图像转换为base64
-            buffer = io.BytesIO()
-            image.save(buffer, format='PNG')
-            image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic?access_token={access_token}"
-            
-            headers = {
-                'Content-Type': 'application/x-www-form-urlencoded'
-            }
-            
-            data = {
-                'image': image_base64,
-                'detect_direction': 'true',
-                'paragraph': 'true',
-                'probability': 'true'
-            }
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=headers, data=data)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # 解析OCR结果
-                    if 'words_result' in result:
-                        words = []
-                        for item in result['words_result']:
-                            words.append(item['words'])
-                        return '\n'.join(words)
-                    else:
-                        error_msg = result.get('error_msg', '未知错误')
-                        error_code = result.get('error_code', '未知错误码')
-                        pdf_logger.error(f"OCR识别失败: 错误码={error_code}, 错误信息={error_msg}")
-                        raise Exception(f"OCR识别失败: 错误码={error_code}, 错误信息={error_msg}")
-                else:
-                    error_text = response.text
-                    pdf_logger.error(f"百度OCR API调用失败: 状态码={response.status_code}, 响应={error_text}")
-                    raise Exception(f"百度OCR API调用失败: {response.status_code}, {error_text}")
-                    
-        except Exception as e:
-            pdf_logger.error(f"百度OCR API调用异常: {str(e)}")
-            raise e
+    async def _call_vlm_api(self, image: Image.Image, image_base64: str = None, on_text: Callable[[str], None] = None) -> str:
+        """调用VLM API分析单页（使用OpenAI兼容格式），image_base64为已编码的页面数据时不再重复编码"""
+        if image_base64 is None:
+            image_base64 = encode_image_base64(image, self.image_format)
+        return await self._post_vlm([
+            {"type": "text", "text": VLM_PAGE_PROMPT},
+            self._vlm_image_part(image_base64)
+        ], on_text)
+
+    async def _call_vlm_api_batch(self, pages: List[RenderedPage], on_text: Callable[[str], None] = None) -> str:
+        """一次VLM请求分析多页，返回带分页标记的模型输出"""
+        content = [{"type": "text", "text": VLM_BATCH_PROMPT.format(count=len(pages))}]
+        for page in pages:
+            content.append({"type": "text", "text": f"第{page.page_num}页："})
+            content.append(self._vlm_image_part(page.get_payload(PROFILE_VLM, self.image_format)))
+        
+        return await self._post_vlm(content, on_text)
+
+    @staticmethod
+    def _split_vlm_pages(response: str, page_nums: set) -> Dict[int, str]:
+        """按“<<<第N页>>>”标记拆分多页VLM结果（按输出顺序），忽略不属于本批次的页码"""
+        texts = {}
+        markers = list(VLM_PAGE_MARKER.finditer(response))
+        for i, marker in enumerate(markers):
+            page_num = int(marker.group(1))
+            end = markers[i + 1].start() if i + 1 < len(markers) else len(response)
+            if page_num in page_nums and page_num not in texts:
+                texts[page_num] = response[marker.end():end].strip()
+        return texts
 
-    async def _call_vlm_api(self, image: Image.Image) -> str:
-        """调用VLM API（使用OpenAI兼容格式）"""
+    async def _post_vlm(self, content: List[Dict[str, Any]], on_text: Callable[[str], None] = None) -> str:
+        """发送VLM请求并返回模型输出：共享并发窗口，429/5xx/超时及无效响应（错误事件、无法解析、空结果）按指数退避重试
+
+        启用流式输出时on_text按间隔接收已生成的全部内容；单次请求超过VLM_TIMEOUT秒且已有输出时不再重试，抛出带部分结果的VLMTimeoutError。
+        """
         try:
             if not self.api_key:
                 raise Exception("VLM API密钥未配置")
             
-            # 将图像转换为base64
-            buffer = io.BytesIO()
-            image.save(buffer, format='PNG')
-            image_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            url = f"{self.base_url}/v1/chat/completions"
+            url = f"{self.base_url}/chat/completions"
             
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
@@ -631,44 +1197,113 @@ class PDFProcessor:
                 "messages": [
                     {
                         "role": "system",
-                        "content": "你是一个专业的文档图像分析助手，擅长从证据文档图像中准确识别和提取文字内容。"
+                        "content": VLM_SYSTEM_PROMPT
                     },
                     {
                         "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "请仔细分析这个证据文档图像，识别并提取其中的所有文字内容。"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}"
-                                }
-                            }
-                        ]
+                        "content": content
                     }
                 ],
                 "temperature": 0.1,
             }
+            if self.vlm_stream:
+                payload["stream"] = True
             
-            pdf_logger.debug(f"调用VLM API: {url}, 模型: {self.vlm_model}")
+            pdf_logger.debug(f"调用VLM API: {url}, 模型: {self.vlm_model}, 流式: {self.vlm_stream}")
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                
-                pdf_logger.debug(f"VLM API响应状态码: {response.status_code}")
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result["choices"][0]["message"]["content"]
-                    pdf_logger.debug(f"VLM API返回内容长度: {len(content)}")
-                    return content
-                else:
+            # 复用进程内共享的HTTP客户端（HTTP/2 + keep-alive），避免每页重新建立连接
+            client = get_http_client()
+            for attempt in range(self.vlm_max_retries + 1):
+                retry_after = None
+                overloaded = False
+                chunks = []
+                started_at = await self.vlm_limiter.acquire()
+                try:
+                    response = await asyncio.wait_for(self._send_vlm_request(client, url, headers, payload, chunks, on_text), self.vlm_timeout)
+                    pdf_logger.debug(f"VLM API响应状态码: {response.status_code}")
+                    
+                    if response.status_code == 200:
+                        content = "".join(chunks)
+                        if not content.strip():
+                            raise VLMResponseError("VLM返回内容为空")
+                        pdf_logger.debug(f"VLM API返回内容长度: {len(content)}")
+                        return content
+                    
                     error_text = response.text
                     pdf_logger.error(f"VLM API调用失败: {response.status_code}, {error_text}")
-                    raise Exception(f"VLM API调用失败: {response.status_code}, {error_text}")
-                    
+                    error = Exception(f"VLM API调用失败: {response.status_code}, {error_text}")
+                    # 只有限流和服务端错误值得重试
+                    overloaded = response.status_code == 429 or response.status_code >= 500
+                    if not overloaded:
+                        raise error
+                    retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+                except (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError, VLMResponseError) as e:
+                    # 响应内容无效不是过载，不缩小并发窗口
+                    overloaded = not isinstance(e, VLMResponseError)
+                    error = Exception(f"VLM API请求失败: {type(e).__name__}: {str(e) or f'超过{self.vlm_timeout:g}秒'}")
+                    # 已生成的内容已计费，保留部分结果而不是重新生成
+                    if "".join(chunks).strip():
+                        raise VLMTimeoutError(f"VLM输出未完成，已保留部分结果: {str(error)}", "".join(chunks)) from None
+                finally:
+                    await self.vlm_limiter.release(started_at, overloaded)
+                
+                if attempt >= self.vlm_max_retries:
+                    raise error
+                delay = retry_after if retry_after is not None else random.uniform(0, min(self.vlm_backoff_max, self.vlm_backoff_base * 2 ** attempt))
+                pdf_logger.warning(f"VLM API第{attempt + 1}次调用失败，{delay:.1f}秒后重试: {str(error)}")
+                await asyncio.sleep(delay)
+                
         except Exception as e:
             pdf_logger.error(f"VLM API调用异常: {str(e)}")
-            raise e 
\ No newline at end of file
+            raise e
+
+    async def _send_vlm_request(self, client: httpx.AsyncClient, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                                chunks: List[str], on_text: Callable[[str], None] = None) -> httpx.Response:
+        """发送一次VLM请求，生成的内容追加到chunks（超时时调用方可取得部分结果）"""
+        if not payload.get("stream"):
+            response = await client.post(url, headers=headers, json=payload)
+            if response.status_code == 200:
+                choices = self._parse_vlm_event(response.text).get("choices") or []
+                content = (choices[0].get("message") or {}).get("content") if choices else None
+                if content:
+                    chunks.append(content)
+            return response
+        
+        async with client.stream("POST", url, headers=headers, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response
+            
+            # 解析SSE：每个"data:"行是一个增量，"[DONE]"表示结束
+            last_progress = time.perf_counter()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                # 只有用量统计等没有choices的事件直接跳过
+                choices = self._parse_vlm_event(data).get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if not delta:
+                    continue
+                chunks.append(delta)
+                if on_text and time.perf_counter() - last_progress >= VLM_PROGRESS_INTERVAL:
+                    last_progress = time.perf_counter()
+                    on_text("".join(chunks))
+            return response
+
+    @staticmethod
+    def _parse_vlm_event(data: str) -> Dict[str, Any]:
+        """解析VLM响应体或流式事件，无法解析或带有error对象时抛出VLMResponseError"""
+        try:
+            event = json.loads(data)
+        except ValueError:
+            raise VLMResponseError(f"无法解析的VLM响应: {data[:200]}") from None
+        if not isinstance(event, dict):
+            raise VLMResponseError(f"无法解析的VLM响应: {data[:200]}")
+        error = event.get("error")
+        if error:
+            message = error.get("message") if isinstance(error, dict) else None
+            raise VLMResponseError(f"VLM返回错误: {message or error}")
+        return event
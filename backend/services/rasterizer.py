@@ -0,0 +1,484 @@
+import os
+import asyncio
+import base64
+import io
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, AsyncIterator, Dict
+import fitz  # PyMuPDF
+from PIL import Image
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import pdf_logger
+from services.disk_cache import DiskCache
+from services.image_preprocess import pixels_to_array, array_to_pixels, preprocess_array, parse_steps, max_cell_ink, PageFingerprint
+
+# 工作进程返回的原始像素数据: (模式, 宽, 高, 行跨度, 像素字节)
+RawPixels = Tuple[str, int, int, int, bytes]
+# 单页渲染结果: (页索引, 各配置的原始像素, 文字层文本, 是否空白页, 页面指纹, 带图片页面的文字层文本)
+PageRenderResult = Tuple[int, Dict[str, RawPixels], Optional[str], bool, Optional[PageFingerprint], Optional[str]]
+
+# Pixmap通道数对应的PIL模式
+_PIXMAP_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+# 图片编码格式对应的MIME类型
+IMAGE_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg"}
+
+# 各处理阶段使用的渲染配置名称
+PROFILE_OCR = "baidu_ocr"
+PROFILE_TESSERACT = "tesseract"
+PROFILE_VLM = "vlm"
+PROFILE_THUMBNAIL = "thumbnail"
+
+# 空白页检测使用的低分辨率渲染DPI
+_BLANK_PREVIEW_DPI = 100
+# 页面指纹（重复页检测的感知哈希）的渲染DPI及算法版本，算法变化后不读取旧缓存
+_FINGERPRINT_DPI = 100
+_FINGERPRINT_VERSION = "phash1"
+# 跳过列表中表示页面指纹已缓存的条目
+_FINGERPRINT_ENTRY = "fingerprint"
+# 嵌入图片宽高均不小于该像素数才可能包含需要识别的文字（忽略分隔线、小图标）
+_RASTER_MIN_PIXELS = 32
+
+# 文字层中视为有效内容的字符：文字、数字及常见中英文标点（乱码、私有区字符不计入）
+_MEANINGFUL_CHAR_RE = re.compile(r"[\w，。、；：？！“”‘’（）《》【】,.;:?!'\"()\[\]<>/\\\-+=%@#&*￥$]")
+
+
+class RenderProfile:
+    """页面渲染配置：分辨率、颜色模式、最长边像素上限以及渲染后的预处理步骤（裁边、二值化）"""
+
+    def __init__(self, dpi: int = 144, color_mode: str = "rgb", max_side: int = 0, preprocess: Tuple[str, ...] = ()):
+        self.dpi = dpi
+        self.color_mode = color_mode.lower()  # rgb 或 gray
+        self.max_side = max_side  # 0表示不限制
+        self.preprocess = tuple(preprocess)
+
+    @classmethod
+    def from_spec(cls, spec: str, default: "RenderProfile") -> "RenderProfile":
+        """从"dpi,颜色模式,最长边,预处理"格式的字符串解析配置，缺省项使用默认值"""
+        if not spec:
+            return default
+        parts = [part.strip() for part in spec.split(",")]
+        try:
+            dpi = int(parts[0]) if len(parts) > 0 and parts[0] else default.dpi
+            color_mode = parts[1] if len(parts) > 1 and parts[1] else default.color_mode
+            max_side = int(parts[2]) if len(parts) > 2 and parts[2] else default.max_side
+            preprocess = parse_steps(parts[3]) if len(parts) > 3 and parts[3] else default.preprocess
+        except ValueError as e:
+            pdf_logger.warning(f"渲染配置格式错误: {spec}（{e}），使用默认配置")
+            return default
+        if color_mode.lower() not in ("rgb", "gray"):
+            pdf_logger.warning(f"不支持的颜色模式 {color_mode}，使用默认配置")
+            return default
+        return cls(dpi, color_mode, max_side, preprocess)
+
+    @property
+    def key(self) -> str:
+        """配置标识，相同配置的渲染结果和编码数据可以共用"""
+        key = f"{self.dpi}-{self.color_mode}-{self.max_side}"
+        return f"{key}-{'+'.join(self.preprocess)}" if self.preprocess else key
+
+    def matrix_for(self, page: fitz.Page) -> fitz.Matrix:
+        """计算页面的缩放矩阵，保证渲染结果不超过最长边上限"""
+        zoom = self.dpi / 72.0
+        if self.max_side > 0:
+            longest = max(page.rect.width, page.rect.height) * zoom
+            if longest > self.max_side:
+                zoom *= self.max_side / longest
+        return fitz.Matrix(zoom, zoom)
+
+    def render(self, page: fitz.Page) -> RawPixels:
+        """按配置渲染页面，直接返回像素缓冲区，避免PNG编码再解码"""
+        colorspace = fitz.csGRAY if self.color_mode == "gray" else fitz.csRGB
+        pix = page.get_pixmap(matrix=self.matrix_for(page), colorspace=colorspace, alpha=False)
+        raw = _PIXMAP_MODES[pix.n], pix.width, pix.height, pix.stride, pix.samples
+        if self.preprocess:
+            raw = array_to_pixels(preprocess_array(pixels_to_array(*raw), self.preprocess))
+        return raw
+
+    def __repr__(self) -> str:
+        return f"RenderProfile(dpi={self.dpi}, color_mode={self.color_mode}, max_side={self.max_side}, preprocess={'+'.join(self.preprocess) or 'none'})"
+
+
+class RenderOptions:
+    """页面渲染选项，会被传递到工作进程，需保持可序列化"""
+
+    def __init__(self, profiles: Dict[str, RenderProfile] = None, text_layer_min_chars: int = 0, text_layer_min_ratio: float = 0.8,
+                 force_render_pages: int = 0, blank_max_ink: float = 0.0, page_fingerprint: bool = False,
+                 text_layer_image_min_area: float = 0.03):
+        self.profiles = profiles or {PROFILE_OCR: RenderProfile(), PROFILE_TESSERACT: RenderProfile(), PROFILE_VLM: RenderProfile()}
+        # 文字层检测阈值，min_chars为0时不检测文字层
+        self.text_layer_min_chars = text_layer_min_chars
+        self.text_layer_min_ratio = text_layer_min_ratio
+        # 带有面积不小于该比例的嵌入图片的页面即使有文字层也需要OCR（结果与文字层合并），为0时不检查
+        self.text_layer_image_min_area = text_layer_image_min_area
+        # 前N页即使有可用文字层也需要渲染VLM图片
+        self.force_render_pages = force_render_pages
+        # 空白页检测阈值（墨迹占比），为0时不检测
+        self.blank_max_ink = blank_max_ink
+        # 是否计算页面指纹（用于文档内重复页检测）
+        self.page_fingerprint = page_fingerprint
+
+    def profiles_for(self, page_index: int, has_text_layer: bool) -> List[str]:
+        """确定页面需要预先渲染的配置：无文字层的页面需要OCR图片，前N页需要VLM图片"""
+        names = []
+        if not has_text_layer:
+            names.append(PROFILE_OCR)
+        if page_index < self.force_render_pages:
+            names.append(PROFILE_VLM)
+        return names
+
+
+def _image_from_raw(raw: RawPixels) -> Image.Image:
+    """由像素缓冲区构建PIL图片，不做拷贝"""
+    mode, width, height, stride, samples = raw
+    return Image.frombuffer(mode, (width, height), samples, "raw", mode, stride, 1)
+
+
+def encode_image(image: Image.Image, fmt: str = "PNG") -> bytes:
+    """将图片编码为指定格式"""
+    fmt = fmt.upper()
+    if fmt == "JPEG" and image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, format=fmt, quality=90)
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def encode_image_base64(image: Image.Image, fmt: str = "PNG") -> str:
+    """将图片编码为指定格式并转为base64字符串"""
+    return base64.b64encode(encode_image(image, fmt)).decode('utf-8')
+
+
+class PageSource:
+    """页面来源：PDF路径、渲染配置以及页面图片缓存，用于按需渲染和读写缓存"""
+
+    def __init__(self, pdf_path: str, profiles: Dict[str, RenderProfile], cache: DiskCache = None,
+                 file_hash: str = None, image_format: str = "PNG"):
+        self.pdf_path = pdf_path
+        self.profiles = profiles
+        self.cache = cache if cache is not None and cache.enabled and file_hash else None
+        self.file_hash = file_hash
+        self.image_format = image_format.upper()
+
+    def profile_key(self, profile_name: str) -> str:
+        profile = self.profiles.get(profile_name)
+        return profile.key if profile else profile_name
+
+    def cache_key(self, page_index: int, profile_name: str, fmt: str) -> str:
+        """页面图片缓存键：文件哈希 + 页索引 + 渲染配置 + 编码格式"""
+        return f"page:{self.file_hash}:{page_index}:{self.profile_key(profile_name)}:{fmt.upper()}"
+
+    def fingerprint_key(self, page_index: int) -> str:
+        """页面指纹缓存键，与页面图片存放在同一缓存中"""
+        return f"page:{self.file_hash}:{page_index}:{_FINGERPRINT_ENTRY}-{_FINGERPRINT_VERSION}-{_FINGERPRINT_DPI}"
+
+    def cached_profiles(self, page_index: int, names: List[str]) -> List[str]:
+        """返回已在缓存中的渲染配置"""
+        if not self.cache:
+            return []
+        return [name for name in names if self.cache.contains(self.cache_key(page_index, name, self.image_format))]
+
+    def render(self, page_index: int, profile_name: str) -> Image.Image:
+        """按需渲染单页的指定配置"""
+        doc = fitz.open(self.pdf_path)
+        try:
+            return _image_from_raw(self.profiles[profile_name].render(doc.load_page(page_index)))
+        finally:
+            doc.close()
+
+
+class RenderedPage:
+    """单页处理数据：页码、按渲染配置区分的图片以及可用的文字层文本
+
+    未预先渲染的配置在首次使用时从页面缓存读取或按需渲染（例如Tesseract回退）。
+    """
+
+    def __init__(self, page_num: int, image: Optional[Image.Image] = None, text_layer: Optional[str] = None,
+                 images: Dict[str, Image.Image] = None, source: PageSource = None, blank: bool = False,
+                 fingerprint: Optional[PageFingerprint] = None, embedded_text: Optional[str] = None):
+        self.page_num = page_num
+        self.text_layer = text_layer
+        # 带有嵌入图片的页面的文字层文本：页面仍需OCR，识别结果与其合并
+        self.embedded_text = embedded_text
+        # 空白页（分隔页、双面扫描的空白背面）不需要OCR和VLM
+        self.blank = blank
+        # 页面指纹，用于识别文档内重复扫描的页面（已缓存时渲染阶段不计算，由load_fingerprint读取）
+        self.fingerprint = fingerprint
+        self._fingerprint_loaded = False
+        self.images: Dict[str, Image.Image] = images or {}
+        # 直接传入的图片（非PDF来源）用于所有处理阶段
+        self._default_image = image
+        self._source = source
+        self._encoded: Dict[Tuple[str, str], bytes] = {}
+        self._payloads: Dict[Tuple[str, str], str] = {}
+
+    @property
+    def image(self) -> Optional[Image.Image]:
+        """OCR阶段使用的图片"""
+        return self.get_image(PROFILE_OCR)
+
+    def _profile_key(self, profile_name: str) -> str:
+        return self._source.profile_key(profile_name) if self._source else profile_name
+
+    def _read_cache(self, profile_name: str, fmt: str) -> Optional[bytes]:
+        if not self._source or not self._source.cache:
+            return None
+        return self._source.cache.get(self._source.cache_key(self.page_num - 1, profile_name, fmt))
+
+    def get_image(self, profile_name: str) -> Optional[Image.Image]:
+        """获取指定渲染配置的图片，依次使用已渲染图片、页面缓存、按需渲染"""
+        if profile_name in self.images:
+            return self.images[profile_name]
+        if self._default_image is not None or not self._source or profile_name not in self._source.profiles:
+            return self._default_image
+
+        # 相同配置的图片直接复用
+        for name, image in self.images.items():
+            if self._profile_key(name) == self._profile_key(profile_name):
+                self.images[profile_name] = image
+                return image
+
+        fmt = self._source.image_format
+        data = self._encoded.get((self._profile_key(profile_name), fmt)) or self._read_cache(profile_name, fmt)
+        if data is not None:
+            self._encoded[(self._profile_key(profile_name), fmt)] = data
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            pdf_logger.debug(f"第{self.page_num}页[{profile_name}]使用缓存图片，尺寸: {image.size}")
+        else:
+            image = self._source.render(self.page_num - 1, profile_name)
+            pdf_logger.debug(f"第{self.page_num}页按需渲染[{profile_name}]，图片尺寸: {image.size}")
+        self.images[profile_name] = image
+        return image
+
+    def load_fingerprint(self) -> Optional[PageFingerprint]:
+        """返回页面指纹：渲染时计算的指纹写入页面缓存，未计算时从页面缓存读取（在后台线程中调用）"""
+        if self._fingerprint_loaded:
+            return self.fingerprint
+        self._fingerprint_loaded = True
+        if not self._source or not self._source.cache:
+            return self.fingerprint
+
+        cache_key = self._source.fingerprint_key(self.page_num - 1)
+        if self.fingerprint is not None:
+            self._source.cache.set(cache_key, self.fingerprint.to_bytes())
+            return self.fingerprint
+        data = self._source.cache.get(cache_key)
+        if data:
+            try:
+                self.fingerprint = PageFingerprint.from_bytes(data)
+            except Exception as e:
+                pdf_logger.warning(f"第{self.page_num}页指纹缓存损坏: {e}")
+                self._source.cache.delete(cache_key)
+        return self.fingerprint
+
+    def release(self):
+        """释放已渲染的图片和编码数据，之后使用时重新从页面缓存读取或按需渲染（直接传入的图片不受影响）"""
+        if self._source is None:
+            return
+        self.images.clear()
+        self._encoded.clear()
+        self._payloads.clear()
+
+    def get_encoded(self, profile_name: str = PROFILE_OCR, fmt: str = "PNG") -> bytes:
+        """返回编码后的图片数据，相同渲染配置的每种格式只编码一次，并写入页面缓存"""
+        fmt = fmt.upper()
+        cache_key = (self._profile_key(profile_name), fmt)
+        if cache_key in self._encoded:
+            return self._encoded[cache_key]
+
+        data = self._read_cache(profile_name, fmt) if profile_name not in self.images else None
+        if data is None:
+            data = encode_image(self.get_image(profile_name), fmt)
+            if self._source and self._source.cache:
+                self._source.cache.set(self._source.cache_key(self.page_num - 1, profile_name, fmt), data)
+        self._encoded[cache_key] = data
+        return data
+
+    def get_payload(self, profile_name: str = PROFILE_OCR, fmt: str = "PNG") -> str:
+        """返回base64编码的图片数据，供OCR和VLM共用"""
+        cache_key = (self._profile_key(profile_name), fmt.upper())
+        if cache_key not in self._payloads:
+            self._payloads[cache_key] = base64.b64encode(self.get_encoded(profile_name, fmt)).decode('utf-8')
+        return self._payloads[cache_key]
+
+
+def has_raster_content(page: fitz.Page, min_area: float) -> bool:
+    """页面是否带有面积不小于页面min_area比例的嵌入图片（如身份证复印件、扫描底图），其中的文字不在文字层中"""
+    page_area = abs(page.rect)
+    if page_area <= 0:
+        return False
+    for info in page.get_image_info():
+        if info.get("width", 0) < _RASTER_MIN_PIXELS or info.get("height", 0) < _RASTER_MIN_PIXELS:
+            continue
+        if abs(fitz.Rect(info["bbox"]) & page.rect) / page_area >= min_area:
+            return True
+    return False
+
+
+def detect_text_layer(page: fitz.Page, min_chars: int, min_ratio: float) -> Optional[str]:
+    """检测页面是否带有可用的文字层，可用时返回文本，否则返回None
+
+    扫描件通常没有文字层；字体编码异常的PDF会提取出大量乱码，通过有效字符占比过滤。
+    """
+    text = page.get_text("text").strip()
+    visible_chars = [ch for ch in text if not ch.isspace()]
+    if len(visible_chars) < min_chars:
+        return None
+
+    meaningful = sum(1 for ch in visible_chars if _MEANINGFUL_CHAR_RE.match(ch))
+    if meaningful < min_chars or meaningful / len(visible_chars) < min_ratio:
+        return None
+    return text
+
+
+def render_gray(page: fitz.Page, dpi: int):
+    """以指定DPI灰度渲染页面，返回数组，用于空白页检测和页面指纹"""
+    zoom = dpi / 72.0
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    return pixels_to_array("L", pix.width, pix.height, pix.stride, pix.samples)
+
+
+def is_blank_page(page: fitz.Page, max_ink: float) -> bool:
+    """空白页判断：带有任何文字（文字层）的页面不是空白页；否则以能分辨细笔画的分辨率渲染，任一小块的墨迹占比超过max_ink即不是空白页"""
+    if page.get_text("text").strip():
+        return False
+    return max_cell_ink(render_gray(page, _BLANK_PREVIEW_DPI)) <= max_ink
+
+
+def render_page(doc: fitz.Document, page_index: int, options: RenderOptions, skip_profiles: Tuple[str, ...] = ()) -> PageRenderResult:
+    """渲染单页，返回 (页索引, 各配置的原始像素, 文字层文本, 是否空白页, 页面指纹, 带图片页面的文字层文本)
+
+    有可用文字层且无需图片时跳过渲染；带有较大嵌入图片的页面按无文字层处理（需要OCR），文字层文本单独返回供合并；
+    空白页不渲染；skip_profiles中的配置和页面指纹（已在页面缓存中）也不渲染。
+    """
+    page = doc.load_page(page_index)
+
+    text_layer = None
+    embedded_text = None
+    if options.text_layer_min_chars > 0:
+        text_layer = detect_text_layer(page, options.text_layer_min_chars, options.text_layer_min_ratio)
+        if text_layer is not None and options.text_layer_image_min_area > 0 and has_raster_content(page, options.text_layer_image_min_area):
+            embedded_text, text_layer = text_layer, None
+
+    if text_layer is None and options.blank_max_ink > 0 and is_blank_page(page, options.blank_max_ink):
+        return page_index, {}, None, True, None, None
+    # 文字层页面按文本判断重复，不需要指纹；已缓存的指纹不再渲染
+    fingerprint = None
+    if options.page_fingerprint and text_layer is None and _FINGERPRINT_ENTRY not in skip_profiles:
+        fingerprint = PageFingerprint.from_array(render_gray(page, _FINGERPRINT_DPI))
+
+    rendered: Dict[str, RawPixels] = {}
+    by_key: Dict[str, RawPixels] = {}
+    for name in options.profiles_for(page_index, text_layer is not None):
+        if name in skip_profiles:
+            continue
+        profile = options.profiles[name]
+        # 相同配置只渲染一次
+        if profile.key not in by_key:
+            by_key[profile.key] = profile.render(page)
+        rendered[name] = by_key[profile.key]
+    return page_index, rendered, text_layer, False, fingerprint, embedded_text
+
+
+def _render_page_range(pdf_path: str, start: int, end: int, options: RenderOptions, skip: Dict[int, Tuple[str, ...]]) -> List[PageRenderResult]:
+    """在工作进程中渲染[start, end)页，每个进程独立打开文档"""
+    doc = fitz.open(pdf_path)
+    try:
+        return [render_page(doc, page_index, options, skip.get(page_index, ())) for page_index in range(start, end)]
+    finally:
+        doc.close()
+
+
+def cached_skip_map(source: PageSource, options: RenderOptions, start: int, end: int) -> Dict[int, Tuple[str, ...]]:
+    """统计[start, end)页中已缓存、无需再渲染的配置（按最多需要的配置检查），包括页面指纹"""
+    skip = {}
+    if source.cache:
+        for page_index in range(start, end):
+            cached = source.cached_profiles(page_index, options.profiles_for(page_index, False))
+            if options.page_fingerprint and source.cache.contains(source.fingerprint_key(page_index)):
+                cached.append(_FINGERPRINT_ENTRY)
+            if cached:
+                skip[page_index] = tuple(cached)
+    return skip
+
+
+def decode_pages(rendered: List[PageRenderResult], source: PageSource) -> List[RenderedPage]:
+    """将渲染结果包装为RenderedPage，图片直接引用像素缓冲区，不做拷贝"""
+    pages = []
+    for page_index, raw_images, text_layer, blank, fingerprint, embedded_text in rendered:
+        images: Dict[str, Image.Image] = {}
+        by_buffer: Dict[int, Image.Image] = {}
+        for name, raw in raw_images.items():
+            if id(raw) not in by_buffer:
+                by_buffer[id(raw)] = _image_from_raw(raw)
+            images[name] = by_buffer[id(raw)]
+            pdf_logger.debug(f"第{page_index + 1}页[{name}]转换完成，图片尺寸: {images[name].size}")
+        if blank:
+            pdf_logger.debug(f"第{page_index + 1}页为空白页，跳过渲染")
+        elif not images:
+            pdf_logger.debug(f"第{page_index + 1}页无需渲染（使用文字层或页面缓存）")
+        pages.append(RenderedPage(page_index + 1, text_layer=text_layer, images=images, source=source, blank=blank,
+                                  fingerprint=fingerprint, embedded_text=embedded_text))
+    return pages
+
+
+class RasterEngine:
+    """多进程PDF光栅化引擎，按页段分片到进程池并按页码顺序返回结果"""
+
+    def __init__(self, workers: int = None, chunk_pages: int = 2):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunk_pages = max(1, chunk_pages)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """延迟创建进程池，所有任务共享"""
+        if self._executor is None:
+            pdf_logger.info(f"创建光栅化进程池: {self.workers}个进程, 每片{self.chunk_pages}页")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            pdf_logger.info("光栅化进程池已关闭")
+
+    async def iter_pages(self, source: PageSource, total_pages: int, options: RenderOptions, lookahead: int = 0) -> AsyncIterator[RenderedPage]:
+        """分片并行渲染页面，按页码顺序返回
+
+        单个页面流同时在途的分片页数不超过 lookahead（至少一个分片），进程池由所有任务共享，多个任务之间并行渲染。
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+
+        shards = [(start, min(start + self.chunk_pages, total_pages)) for start in range(0, total_pages, self.chunk_pages)]
+        max_inflight = max(1, min(self.workers, lookahead // self.chunk_pages))
+        pending = deque()
+        next_shard = 0
+
+        try:
+            while next_shard < len(shards) or pending:
+                while next_shard < len(shards) and len(pending) < max_inflight:
+                    start, end = shards[next_shard]
+                    skip = cached_skip_map(source, options, start, end)
+                    pending.append(loop.run_in_executor(executor, _render_page_range, source.pdf_path, start, end, options, skip))
+                    next_shard += 1
+
+                rendered = await pending.popleft()
+                for page in decode_pages(rendered, source):
+                    yield page
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,118 @@
+import os
+import asyncio
+import time
+from typing import Dict, Optional
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import logger
+
+
+class AsyncTokenBucket:
+    """asyncio令牌桶限流器，按rate个/秒补充令牌，最多积累burst个
+
+    采用预约方式：令牌不足时先记账（令牌数可为负），调用方只等待到自己的预约时刻，
+    等待期间不占用事件循环，多个任务按调用顺序依次放行。
+    """
+
+    def __init__(self, rate: float, burst: int = 1, name: str = "limiter"):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.name = name
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int = 1):
+        """获取令牌，令牌不足时异步等待"""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self._tokens -= tokens
+        if self._tokens >= 0:
+            return
+
+        wait_time = -self._tokens / self.rate
+        logger.debug(f"[{self.name}] 限流等待{wait_time:.2f}秒")
+        try:
+            await asyncio.sleep(wait_time)
+        except asyncio.CancelledError:
+            # 取消的任务归还预约的令牌
+            self._refill()
+            self._tokens = min(self.burst, self._tokens + tokens)
+            raise
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD自适应并发控制器：请求成功时并发窗口加性增长（每轮约+1），遇到限流或服务端错误时减半
+
+    窗口在min_limit与max_limit之间浮动，持续逼近服务端实际能承受的并发；同一轮拥塞中
+    （减半之前已发出的请求）再次失败不会重复减半。
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 32, name: str = "concurrency"):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.name = name
+        self._inflight = 0
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def acquire(self) -> float:
+        """等待并发名额，返回请求开始时间（释放时用于判断是否属于同一轮拥塞）"""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._inflight < int(self.limit))
+            self._inflight += 1
+        return time.monotonic()
+
+    async def release(self, started_at: float, overloaded: bool = False):
+        """释放名额并调整窗口：overloaded表示遇到429/5xx/超时"""
+        condition = self._get_condition()
+        async with condition:
+            self._inflight -= 1
+            if overloaded:
+                if started_at >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = time.monotonic()
+                    logger.warning(f"[{self.name}] 服务端过载，并发窗口减半为{int(self.limit)}")
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            condition.notify_all()
+
+
+_limiters: Dict[str, AsyncTokenBucket] = {}
+_concurrency_limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+
+
+def get_rate_limiter(name: str, rate: float, burst: int = 1) -> AsyncTokenBucket:
+    """获取进程内共享的限流器，同名限流器被所有任务共用"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = AsyncTokenBucket(rate, burst, name)
+        _limiters[name] = limiter
+        logger.info(f"创建限流器 {name}: {rate}次/秒, 突发{limiter.burst}次")
+    return limiter
+
+
+def get_concurrency_limiter(name: str, initial: int = 4, min_limit: int = 1, max_limit: int = 32) -> AdaptiveConcurrencyLimiter:
+    """获取进程内共享的自适应并发控制器，同名控制器被所有任务共用"""
+    limiter = _concurrency_limiters.get(name)
+    if limiter is None:
+        limiter = AdaptiveConcurrencyLimiter(initial, min_limit, max_limit, name)
+        _concurrency_limiters[name] = limiter
+        logger.info(f"创建并发控制器 {name}: 初始{int(limiter.limit)}, 范围{limiter.min_limit}-{limiter.max_limit}")
+    return limiter
@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, Any, List, Optional, Type
+from pydantic import create_model, BaseModel, Field
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import ai_logger
+
+# 影响提取结果的字段属性（placeholder等仅用于前端展示）
+FIELD_ATTRIBUTES = ("key", "label", "type", "required", "options")
+
+# 字段类型对应的Python类型和JSON Schema类型
+_PYTHON_TYPES = {"text": str, "textarea": str, "date": date, "datetime": datetime, "number": float}
+_JSON_TYPES = {"number": "number"}
+_FORMAT_HINTS = {"date": "，格式YYYY-MM-DD", "datetime": "，格式YYYY-MM-DD HH:MM:SS"}
+
+
+def canonical_fields(extraction_fields: List[Dict]) -> List[Dict[str, Any]]:
+    """字段定义的规范形式，只保留影响提取的属性"""
+    return [{name: field.get(name) for name in FIELD_ATTRIBUTES} for field in extraction_fields]
+
+
+def fields_version(extraction_fields: List[Dict]) -> str:
+    """字段定义的版本哈希，模板字段变化时随之变化"""
+    canonical = json.dumps(canonical_fields(extraction_fields), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+class CompiledSchema:
+    """一组提取字段编译后的Pydantic模型和JSON Schema（供结构化输出使用）"""
+
+    __slots__ = ("version", "model", "json_schema")
+
+    def __init__(self, version: str, model: Type[BaseModel], json_schema: Dict[str, Any]):
+        self.version = version
+        self.model = model
+        self.json_schema = json_schema
+
+    def response_format(self) -> Dict[str, Any]:
+        """OpenAI兼容接口的json_schema结构化输出参数"""
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": f"extracted_data_{self.version}", "schema": self.json_schema, "strict": True}
+        }
+
+
+def compile_schema(extraction_fields: List[Dict], version: str = None) -> CompiledSchema:
+    """根据字段配置生成Pydantic模型和JSON Schema
+
+    JSON Schema满足严格模式要求：所有字段都列入required并允许null（无法提取时返回null），不允许额外字段；
+    必填校验由Pydantic模型完成。
+    """
+    version = version or fields_version(extraction_fields)
+    field_definitions: Dict[str, Any] = {}
+    properties: Dict[str, Any] = {}
+    for field_conf in extraction_fields:
+        key = field_conf.get("key")
+        if not key:
+            ai_logger.warning(f"字段配置中缺少'key': {field_conf}")
+            continue
+
+        label = field_conf.get("label", key)
+        field_type_str = field_conf.get("type", "text")
+        if field_type_str not in _PYTHON_TYPES:
+            ai_logger.warning(f"未知的字段类型 '{field_type_str}' for key '{key}',默认为str")
+        python_type = _PYTHON_TYPES.get(field_type_str, str)
+
+        if field_conf.get("required", False):
+            field_definitions[key] = (python_type, Field(..., description=label))
+        else:
+            field_definitions[key] = (Optional[python_type], Field(default=None, description=label))
+
+        prop: Dict[str, Any] = {
+            "type": [_JSON_TYPES.get(field_type_str, "string"), "null"],
+            "description": f"{label}{_FORMAT_HINTS.get(field_type_str, '')}"
+        }
+        if field_conf.get("options"):
+            prop["enum"] = list(field_conf["options"]) + [None]
+        properties[key] = prop
+
+    if not field_definitions:
+        ai_logger.error("无法根据配置创建有效的Pydantic模型，没有有效的字段定义。")
+
+    model = create_model(f"ExtractedDataModel_{version}", **field_definitions)
+    json_schema = {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+    return CompiledSchema(version, model, json_schema)
+
+
+class SchemaRegistry:
+    """提取模板的编译缓存：每个字段定义版本只编译一次，按最近使用淘汰"""
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._schemas: "OrderedDict[str, CompiledSchema]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, extraction_fields: List[Dict]) -> CompiledSchema:
+        """获取字段定义对应的编译结果，未编译时编译并缓存"""
+        version = fields_version(extraction_fields)
+        with self._lock:
+            compiled = self._schemas.get(version)
+            if compiled is not None:
+                self._schemas.move_to_end(version)
+                return compiled
+
+        compiled = compile_schema(extraction_fields, version)
+        ai_logger.debug(f"编译提取字段Schema: 版本 {version}, 字段数 {len(compiled.json_schema['properties'])}")
+        with self._lock:
+            self._schemas[version] = compiled
+            while len(self._schemas) > self.max_entries:
+                self._schemas.popitem(last=False)
+        return compiled
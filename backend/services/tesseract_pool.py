@@ -0,0 +1,66 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from PIL import Image
+import pytesseract
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import pdf_logger
+
+# 配置Tesseract路径（Windows用户可能需要设置）
+# pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+
+def _image_to_string(image: Image.Image, lang: str) -> Tuple[str, float]:
+    """进程池工作函数：识别单张图片，返回 (文本, 耗时秒数)"""
+    start = time.perf_counter()
+    try:
+        text = pytesseract.image_to_string(image, lang=lang)
+    except Exception as e:
+        # pytesseract的部分异常无法跨进程反序列化，会导致整个进程池失效，统一转换为RuntimeError
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    return text, time.perf_counter() - start
+
+
+class TesseractPool:
+    """Tesseract进程池，百度OCR失败时把回退识别分散到多个CPU核心，不阻塞事件循环
+
+    同时提交到进程池的页数不超过进程数，避免大批量回退时图片堆积在内存中。
+    """
+
+    def __init__(self, workers: int = None, lang: str = "chi_sim+eng"):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.lang = lang
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """延迟创建进程池，所有任务共享"""
+        if self._executor is None:
+            pdf_logger.info(f"创建Tesseract进程池: {self.workers}个进程")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            pdf_logger.info("Tesseract进程池已关闭")
+
+    async def recognize(self, image: Image.Image) -> Tuple[str, float]:
+        """异步识别图片，返回 (文本, 识别耗时秒数)；进程池禁用时在线程中执行"""
+        if not self.enabled:
+            return await asyncio.to_thread(_image_to_string, image, self.lang)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), _image_to_string, image, self.lang)
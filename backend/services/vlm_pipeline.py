@@ -0,0 +1,98 @@
+import os
+import asyncio
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import pdf_logger
+from services.rasterizer import RenderedPage
+
+# 页面需要VLM复核的优先级：数值越小越优先
+PRIORITY_FAILED = 0
+PRIORITY_EMPTY = 1
+PRIORITY_LOW_CONFIDENCE = 2
+PRIORITY_UNKNOWN = 3
+
+
+def vlm_priority(record: Dict[str, Any], confidence_threshold: float) -> Optional[int]:
+    """根据OCR页面记录判断是否需要VLM复核，返回优先级，不需要时返回None"""
+    if not record["success"] or record["method"] == "tesseract_fallback":
+        return PRIORITY_FAILED
+    if record["method"] != "baidu_ocr":
+        return None
+    if record["text_length"] == 0:
+        return PRIORITY_EMPTY
+    confidence = record.get("confidence")
+    if confidence is None:
+        return PRIORITY_UNKNOWN
+    return PRIORITY_LOW_CONFIDENCE if confidence < confidence_threshold else None
+
+
+class VLMPipeline:
+    """VLM流水线：与OCR并发运行，页面就绪后立即进入队列并按批次提交，在途请求数由VLM并发窗口控制
+
+    按前N页选择时页面渲染完成即提交；按置信度选择时，OCR识别失败、无文字或置信度低于阈值的页面在该页OCR完成后
+    立即提交（预算用完为止），缺少置信度的页面在OCR全部完成后填补剩余预算。
+    """
+
+    def __init__(self, process_batch: Callable[[List[RenderedPage]], Awaitable[List[Dict[str, Any]]]],
+                 batch_pages: int = 1, budget: int = 0, confidence_threshold: float = 0.9):
+        self.process_batch = process_batch
+        self.batch_pages = max(1, batch_pages)
+        self.budget = budget
+        self.confidence_threshold = confidence_threshold
+        self.selected: List[int] = []
+        # 缺少置信度、等待OCR全部完成后填补剩余预算的页面 (优先级, 置信度, 页码, 页面)
+        self._deferred: List[tuple] = []
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._runner = asyncio.create_task(self._run())
+
+    def submit(self, page: RenderedPage) -> bool:
+        """提交页面进行VLM分析，超出预算时返回False"""
+        if len(self.selected) >= self.budget:
+            return False
+        self.selected.append(page.page_num)
+        self._queue.put_nowait(page)
+        return True
+
+    def offer(self, page: RenderedPage, record: Dict[str, Any]):
+        """根据页面的OCR结果决定是否提交VLM"""
+        priority = vlm_priority(record, self.confidence_threshold)
+        if priority is None:
+            return
+        if priority >= PRIORITY_UNKNOWN:
+            self._deferred.append((priority, record.get("confidence") or 0.0, page.page_num, page))
+        elif self.submit(page):
+            pdf_logger.debug(f"第{page.page_num}页OCR识别失败、无文字或置信度低，提交VLM")
+
+    async def _run(self) -> List[Dict[str, Any]]:
+        """从队列读取页面，凑满一批即提交，队列结束后等待全部批次完成"""
+        batch = []
+        while True:
+            page = await self._queue.get()
+            if page is None:
+                break
+            batch.append(page)
+            if len(batch) >= self.batch_pages:
+                self._tasks.append(asyncio.create_task(self.process_batch(batch)))
+                batch = []
+        if batch:
+            self._tasks.append(asyncio.create_task(self.process_batch(batch)))
+
+        results = await asyncio.gather(*self._tasks)
+        return sorted((record for records in results for record in records), key=lambda p: p["page_num"])
+
+    async def finish(self) -> List[Dict[str, Any]]:
+        """所有页面提交完毕：用缺少置信度的页面按页码顺序填补剩余预算，等待VLM完成并按页码返回结果"""
+        for _, _, _, page in sorted(self._deferred, key=lambda item: item[:3]):
+            if not self.submit(page):
+                break
+        self._deferred.clear()
+        self._queue.put_nowait(None)
+        return await self._runner
+
+    def cancel(self):
+        """取消未完成的VLM任务"""
+        for task in self._tasks:
+            task.cancel()
+        self._runner.cancel()
@@ -0,0 +1,72 @@
+import os
+import io
+import random
+import unittest
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageFont
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.rasterizer import is_blank_page
+
+# A4扫描件（150dpi）及默认空白页阈值
+SCAN_SIZE = (1240, 1754)
+MAX_INK = 0.02
+
+
+def scanned_page(doc: fitz.Document, draw=None) -> fitz.Page:
+    """插入一页只有整页图片的扫描件，draw在图片上绘制内容"""
+    image = Image.new("L", SCAN_SIZE, 250)
+    if draw:
+        draw(ImageDraw.Draw(image))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    page = doc.new_page()
+    page.insert_image(page.rect, stream=buffer.getvalue())
+    return page
+
+
+class BlankPageTest(unittest.TestCase):
+    def setUp(self):
+        self.doc = fitz.open()
+        self.font = ImageFont.load_default(size=24)
+
+    def tearDown(self):
+        self.doc.close()
+
+    def test_empty_pages_are_blank(self):
+        self.assertTrue(is_blank_page(self.doc.new_page(), MAX_INK))
+        self.assertTrue(is_blank_page(scanned_page(self.doc), MAX_INK))
+
+    def test_scanner_noise_is_blank(self):
+        rng = random.Random(0)
+
+        def specks(draw):
+            for _ in range(40):
+                x, y = rng.randrange(100, 1140), rng.randrange(100, 1650)
+                draw.point((x, y), fill=120)
+
+        self.assertTrue(is_blank_page(scanned_page(self.doc, specks), MAX_INK))
+
+    def test_digital_signature_line_is_not_blank(self):
+        page = self.doc.new_page()
+        page.insert_text((400, 700), "签名：张三", fontname="china-s", fontsize=11)
+        self.assertFalse(is_blank_page(page, MAX_INK))
+
+    def test_scanned_one_line_is_not_blank(self):
+        page = scanned_page(self.doc, lambda draw: draw.text((200, 300), "End of document text", fill=0, font=self.font))
+        self.assertFalse(is_blank_page(page, MAX_INK))
+
+    def test_scanned_page_number_is_not_blank(self):
+        page = scanned_page(self.doc, lambda draw: draw.text((610, 1680), "3", fill=0, font=self.font))
+        self.assertFalse(is_blank_page(page, MAX_INK))
+
+    def test_scanned_thin_signature_is_not_blank(self):
+        def signature(draw):
+            points = [(800 + i * 6, 1500 + (12 if i % 2 else -12)) for i in range(30)]
+            draw.line(points, fill=40, width=2)
+
+        self.assertFalse(is_blank_page(scanned_page(self.doc, signature), MAX_INK))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import io
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageFont
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.image_preprocess import PageFingerprint
+from services.duplicate_pages import DuplicatePageIndex, same_text
+
+# A4扫描件（100dpi，与页面指纹的渲染分辨率相同）
+SCAN_SIZE = (827, 1169)
+
+
+def statement(page_label: str) -> Image.Image:
+    """同一模板的流水单：正文相同，只有页脚小字里的页码不同"""
+    image = Image.new("L", SCAN_SIZE, 250)
+    draw = ImageDraw.Draw(image)
+    draw.text((80, 80), "ACCOUNT STATEMENT", fill=20, font=ImageFont.load_default(size=28))
+    small = ImageFont.load_default(size=11)
+    for i in range(30):
+        draw.text((80, 160 + i * 28), f"2024-01-{i + 1:02d}  TRANSFER  {1000 + i * 37}.00  REF{880000 + i * 91}", fill=30, font=small)
+    draw.text((80, 1100), f"scan page {page_label} of 12", fill=30, font=small)
+    return image
+
+
+def rescan(image: Image.Image, angle: float, scale: float) -> Image.Image:
+    """模拟重新扫描：轻微倾斜、缩放并加入噪点"""
+    width, height = image.size
+    rotated = image.rotate(angle, resample=Image.BILINEAR, fillcolor=250)
+    scaled = rotated.resize((round(width * scale), round(height * scale)), Image.BILINEAR)
+    result = Image.new("L", image.size, 250)
+    result.paste(scaled, ((width - scaled.width) // 2, (height - scaled.height) // 2))
+    noise = np.random.default_rng(0).integers(-6, 7, (height, width))
+    return Image.fromarray(np.clip(np.asarray(result, dtype=np.int16) + noise, 0, 255).astype(np.uint8))
+
+
+def fingerprint(image: Image.Image) -> PageFingerprint:
+    return PageFingerprint.from_array(np.asarray(image))
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_rescan_is_candidate(self):
+        original = statement("3")
+        for angle, scale in ((0.3, 1.0), (0.0, 0.99), (-0.3, 0.99)):
+            with self.subTest(angle=angle, scale=scale):
+                index = DuplicatePageIndex()
+                index.candidates(1, fingerprint(original))
+                self.assertEqual(index.candidates(2, fingerprint(rescan(original, angle, scale))), [1])
+
+    def test_small_print_difference_is_only_candidate(self):
+        # 感知哈希分辨不出小字里的个别数字，是否重复由识别文本决定
+        index = DuplicatePageIndex()
+        index.candidates(1, fingerprint(statement("3")))
+        self.assertEqual(index.candidates(2, fingerprint(statement("4"))), [1])
+
+    def test_different_page_is_not_candidate(self):
+        other = Image.new("L", SCAN_SIZE, 250)
+        ImageDraw.Draw(other).text((80, 400), "ANNEX\nSIGNED COPY", fill=20, font=ImageFont.load_default(size=48))
+        index = DuplicatePageIndex()
+        index.candidates(1, fingerprint(statement("3")))
+        self.assertEqual(index.candidates(2, fingerprint(other)), [])
+
+    def test_serialization(self):
+        value = fingerprint(statement("3"))
+        restored = PageFingerprint.from_bytes(value.to_bytes())
+        self.assertEqual((restored.phash, restored.aspect), (value.phash, value.aspect))
+
+    def test_same_text(self):
+        self.assertTrue(same_text("scan page 3\nof 12", "scan page 3 of 12"))
+        self.assertFalse(same_text("scan page 3 of 12", "scan page 4 of 12"))
+        self.assertFalse(same_text("", ""))
+
+
+class DuplicatePipelineTest(unittest.TestCase):
+    """页面流水线：指纹相近只作为候选，识别文本相同才复用原页面的结果"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        env = {
+            "RASTER_WORKERS": "0",
+            "OCR_CACHE_MAX_MB": "0",
+            "VLM_CACHE_MAX_MB": "0",
+            "PAGE_CACHE_MAX_MB": "0",
+            "BAIDU_OCR_BATCH_PAGES": "1",
+        }
+        with mock.patch.dict(os.environ, env):
+            from services.pdf_processor import PDFProcessor
+            self.processor = PDFProcessor()
+
+    def tearDown(self):
+        self.processor.raster_engine.shutdown()
+        self.tmp.cleanup()
+
+    def build_pdf(self, images):
+        path = os.path.join(self.tmp.name, "scan.pdf")
+        doc = fitz.open()
+        for image in images:
+            buffer = io.BytesIO()
+            image.save(buffer, "PNG")
+            page = doc.new_page(width=595, height=842)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+        doc.save(path)
+        doc.close()
+        return path
+
+    def process(self, images, texts):
+        """按页码返回模拟的OCR文本，处理整个文档"""
+        async def ocr_page(page):
+            text = texts[page.page_num]
+            return {"page_num": page.page_num, "method": "baidu_ocr", "success": True,
+                    "text": text, "text_length": len(text), "error": None}
+
+        async def run():
+            stream = self.processor.open_page_stream(self.build_pdf(images))
+            with mock.patch.object(self.processor.baidu_ocr, "get_access_token", mock.AsyncMock()), \
+                    mock.patch.object(self.processor, "_ocr_page", ocr_page):
+                return await self.processor.process_images_batch(stream, max_vlm_pages=0)
+
+        return {p["page_num"]: p for p in asyncio.run(run())["ocr_result"]["pages"]}
+
+    def test_one_digit_in_small_print_is_not_duplicate(self):
+        pages = self.process([statement("3"), statement("4")],
+                             {1: "ACCOUNT STATEMENT ... scan page 3 of 12", 2: "ACCOUNT STATEMENT ... scan page 4 of 12"})
+        self.assertEqual(pages[2]["method"], "baidu_ocr")
+        self.assertIsNone(pages[2].get("duplicate_of"))
+        self.assertIn("scan page 4", pages[2]["text"])
+
+    def test_rescan_is_duplicate(self):
+        original = statement("3")
+        text = "ACCOUNT STATEMENT ... scan page 3 of 12"
+        pages = self.process([original, statement("4"), rescan(original, 0.3, 0.99)],
+                             {1: text, 2: "ACCOUNT STATEMENT ... scan page 4 of 12", 3: text})
+        self.assertEqual(pages[3]["method"], "duplicate")
+        self.assertEqual(pages[3]["duplicate_of"], 1)
+        self.assertIsNone(pages[2].get("duplicate_of"))
+
+
+if __name__ == "__main__":
+    unittest.main()